@@ -3,42 +3,26 @@ import { Card, Row, Col, Table, Badge, Button, ButtonGroup, Form } from 'react-b
 import { Link } from 'react-router-dom';
 import axios from '../axiosInstance';
 
+function authConfig() {
+  let userInfo = null;
+  try { userInfo = JSON.parse(localStorage.getItem('userInfo') || 'null'); } catch { userInfo = null; }
+  return userInfo?.token ? { headers: { Authorization: `Bearer ${userInfo.token}` } } : {};
+}
+
 function useDashboardData() {
   const [loading, setLoading] = React.useState(true);
   const [error, setError] = React.useState('');
-  const [data, setData] = React.useState({ users: [], orders: [], products: [], analytics: null });
-  const userInfoRef = React.useRef(null);
-
-  React.useEffect(() => {
-    try { userInfoRef.current = JSON.parse(localStorage.getItem('userInfo') || 'null'); } catch { userInfoRef.current = null; }
-  }, []);
+  const [data, setData] = React.useState(null);
 
   React.useEffect(() => {
     let mounted = true;
     (async () => {
       try {
         setLoading(true); setError('');
-        const auth = userInfoRef.current?.token ? { headers: { Authorization: `Bearer ${userInfoRef.current.token}` } } : {};
-        // Load users and orders in parallel
-        const [u, o, a] = await Promise.all([
-          axios.get('/api/users/', auth),
-          axios.get('/api/orders/', auth),
-          axios.get('/api/orders/analytics/?days=365', auth),
-        ]);
-        // Load up to 5 pages of products for low-stock view
-        const first = await axios.get('/api/products/?page=1&sort_by=name&order=asc');
-        const totalPages = Math.min(Number(first.data?.pages || 1), 5);
-        const pageCalls = [];
-        for (let p = 2; p <= totalPages; p++) pageCalls.push(axios.get(`/api/products/?page=${p}&sort_by=name&order=asc`));
-        const rest = pageCalls.length ? await Promise.all(pageCalls) : [];
-        const products = [ ...(first.data?.products || []), ...rest.flatMap(r => r.data?.products || []) ];
+        // Every figure comes precomputed from the server in one payload
+        const { data: summary } = await axios.get('/api/orders/dashboard/', authConfig());
         if (!mounted) return;
-        setData({
-          users: Array.isArray(u.data) ? u.data : [],
-          orders: Array.isArray(o.data) ? o.data : (o.data?.orders || []),
-          products,
-          analytics: a?.data || null,
-        });
+        setData(summary);
       } catch (e) {
         if (!mounted) return;
         setError(e?.response?.data?.detail || e?.message || 'Failed to load dashboard');
@@ -50,87 +34,56 @@ function useDashboardData() {
   return { loading, error, data };
 }
 
+// Range buttons map onto the summary's KPI windows
+const RANGES = [
+  { key: 'today', label: 'Today', days: 1 },
+  { key: 'week', label: '7d', days: 7 },
+  { key: 'month', label: '30d', days: 30 },
+  { key: 'quarter', label: '90d', days: 90 },
+  { key: 'year', label: '365d', days: 365 },
+];
+
+function dayKey(d) {
+  const pad = (n) => String(n).padStart(2, '0');
+  return `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())}`;
+}
+
 export default function DashboardAdmin() {
   const { loading, error, data } = useDashboardData();
 
   // Date range filter
-  const [range, setRange] = React.useState('30'); // 7 | 30 | 90 | 365 | all
-  const now = React.useMemo(() => new Date(), []);
+  const [range, setRange] = React.useState('month');
+  const days = RANGES.find(r => r.key === range)?.days || 30;
   const fromDate = React.useMemo(() => {
-    if (range === 'all') return new Date(0);
     const d = new Date();
-    d.setDate(d.getDate() - Number(range));
+    d.setHours(0,0,0,0);
+    d.setDate(d.getDate() - (days - 1));
     return d;
-  }, [range]);
+  }, [days]);
 
-  const ordersInRange = React.useMemo(() => {
-    const list = Array.isArray(data.orders) ? data.orders : [];
-    return list.filter(o => {
-      const ts = new Date(o.createdAt || o.created_at || 0).getTime();
-      return Number.isFinite(ts) && ts >= fromDate.getTime();
-    });
-  }, [data.orders, fromDate]);
+  const kpi = data?.kpis?.[range] || {};
+  const orderCount = Number(kpi.orderCount || 0);
+  const totalSales = Number(kpi.sales || 0);
+  const avgOrderValue = Number(kpi.averageOrderValue || 0);
+  const paidCount = Number(kpi.paidCount || 0);
+  const pendingCount = orderCount - Number(kpi.deliveredCount || 0);
+  const deliveredRate = Math.round((Number(kpi.deliveredCount || 0) / (orderCount || 1)) * 100);
+  const stock = data?.stock || {};
 
-  const totalSales = React.useMemo(() => ordersInRange.reduce((sum, o) => sum + (o.totalPrice ?? o.total_price ?? 0), 0), [ordersInRange]);
-  const avgOrderValue = React.useMemo(() => ordersInRange.length ? totalSales / ordersInRange.length : 0, [ordersInRange, totalSales]);
-  const pendingCount = React.useMemo(() => ordersInRange.filter(o => !(o.isDelivered || o.deliveredAt)).length, [ordersInRange]);
-  const paidCount = React.useMemo(() => ordersInRange.filter(o => (o.isPaid || o.paidAt)).length, [ordersInRange]);
-  const deliveredRate = React.useMemo(() => {
-    const n = ordersInRange.length || 1;
-    const delivered = ordersInRange.filter(o => (o.isDelivered || o.deliveredAt)).length;
-    return Math.round((delivered / n) * 100);
-  }, [ordersInRange]);
-  const paidRate = React.useMemo(() => {
-    const n = ordersInRange.length || 1;
-    return Math.round((paidCount / n) * 100);
-  }, [ordersInRange, paidCount]);
-
-  // Build daily revenue series for line chart
+  // Daily revenue series for line chart; days without orders have no rollup row
   const revenueSeries = React.useMemo(() => {
-    // bucket by day for the chosen range
-    const days = [];
-    const dayMs = 24 * 60 * 60 * 1000;
-    const start = new Date(fromDate);
-    start.setHours(0,0,0,0);
-    const end = new Date(now);
+    const byDay = new Map((data?.revenue || []).map(r => [r.day, Number(r.sales || 0)]));
+    const series = [];
+    const end = new Date();
     end.setHours(0,0,0,0);
-    for (let t = start.getTime(); t <= end.getTime(); t += dayMs) {
-      days.push({ t, total: 0 });
-    }
-    const byDay = new Map(days.map(d => [d.t, d]));
-    for (const o of ordersInRange) {
-      const t = new Date(o.createdAt || o.created_at || 0);
-      t.setHours(0,0,0,0);
-      const key = t.getTime();
-      const bucket = byDay.get(key);
-      if (bucket) bucket.total += (o.totalPrice ?? o.total_price ?? 0);
-    }
-    return days.map(d => ({ x: d.t, y: d.total }));
-  }, [ordersInRange, fromDate, now]);
-
-  // Compute top products by revenue using order items
-  const topProducts = React.useMemo(() => {
-    const map = new Map();
-    for (const o of ordersInRange) {
-      const items = Array.isArray(o.orderItems) ? o.orderItems : (o.orderitems || []);
-      for (const it of items) {
-        const key = String(it.product || it.name || it.id);
-        const prev = map.get(key) || { name: it.name || `#${it.product || 'item'}`, qty: 0, revenue: 0 };
-        prev.qty += Number(it.qty || 0);
-        prev.revenue += Number(it.price || 0) * Number(it.qty || 0);
-        map.set(key, prev);
-      }
+    for (const d = new Date(fromDate); d <= end; d.setDate(d.getDate() + 1)) {
+      series.push({ x: d.getTime(), y: byDay.get(dayKey(d)) || 0 });
     }
-    return Array.from(map.values()).sort((a,b) => b.revenue - a.revenue).slice(0,5);
-  }, [ordersInRange]);
+    return series;
+  }, [data, fromDate]);
 
-  // Low stock products
-  const lowStock = React.useMemo(() => {
-    const list = Array.isArray(data.products) ? data.products : [];
-    return list.filter(p => (p.countInStock ?? 0) > 0 && (p.countInStock ?? 0) < 5)
-               .sort((a,b) => (a.countInStock ?? 0) - (b.countInStock ?? 0))
-               .slice(0, 8);
-  }, [data.products]);
+  const topProducts = data?.topProducts || [];
+  const lowStock = (stock.lowStockProducts || []).slice(0, 8);
 
   // SVG line chart generator
   function RevenueChart({ series, height = 100 }) {
@@ -177,26 +130,17 @@ export default function DashboardAdmin() {
     );
   }
 
-  const activeProducts = React.useMemo(() => (Array.isArray(data.products) ? data.products.filter(p => (p.countInStock ?? 0) > 0).length : 0), [data.products]);
-
-  function exportOrdersCsv() {
-    const rows = [
-      ['ID','Date','Total','Paid','Delivered'],
-      ...ordersInRange.map(o => [
-        o._id || o.id,
-        new Date(o.createdAt || o.created_at || 0).toISOString(),
-        (o.totalPrice ?? o.total_price ?? 0),
-        (o.isPaid || o.paidAt) ? 'Yes' : 'No',
-        (o.isDelivered || o.deliveredAt) ? 'Yes' : 'No',
-      ])
-    ];
-    const blob = new Blob(rows.map(r => r.join(',')).join('\n'), { type: 'text/csv;charset=utf-8;' });
+  async function exportOrdersCsv() {
+    const { data: blob } = await axios.get(`/api/orders/export/csv/?from=${dayKey(fromDate)}`, { ...authConfig(), responseType: 'blob' });
     const url = URL.createObjectURL(blob);
     const a = document.createElement('a');
-    a.href = url; a.download = `orders_${range}d.csv`; document.body.appendChild(a); a.click(); a.remove();
+    a.href = url; a.download = `orders_${range}.csv`; document.body.appendChild(a); a.click(); a.remove();
     URL.revokeObjectURL(url);
   }
 
+  if (loading) return <div className="text-muted py-4">Loading dashboard…</div>;
+  if (error) return <div className="text-danger py-4">{error}</div>;
+
   return (
     <div>
       {/* Range and quick actions */}
@@ -204,9 +148,9 @@ export default function DashboardAdmin() {
         <Col md="auto">
           <div className="text-muted small">Date range</div>
           <ButtonGroup>
-            {['7','30','90','365','all'].map(r => (
-              <Button key={r} size="sm" variant={range===r?'dark':'outline-dark'} onClick={()=>setRange(r)}>
-                {r==='all'?'All':`${r}d`}
+            {RANGES.map(r => (
+              <Button key={r.key} size="sm" variant={range===r.key?'dark':'outline-dark'} onClick={()=>setRange(r.key)}>
+                {r.label}
               </Button>
             ))}
           </ButtonGroup>
@@ -223,7 +167,7 @@ export default function DashboardAdmin() {
           <Card className="shadow-sm">
             <Card.Body>
               <div className="text-muted">Users</div>
-              <div className="display-6">{(data.users || []).length}</div>
+              <div className="display-6">{data?.users?.total ?? 0}</div>
             </Card.Body>
           </Card>
         </Col>
@@ -231,7 +175,7 @@ export default function DashboardAdmin() {
           <Card className="shadow-sm">
             <Card.Body>
               <div className="text-muted">Orders</div>
-              <div className="display-6">{ordersInRange.length}</div>
+              <div className="display-6">{orderCount}</div>
             </Card.Body>
           </Card>
         </Col>
@@ -270,14 +214,14 @@ export default function DashboardAdmin() {
             <Card.Body>
               <div className="d-flex justify-content-between"><span>Pending</span><strong>{pendingCount}</strong></div>
               <div className="d-flex justify-content-between"><span>Delivered rate</span><strong>{deliveredRate}%</strong></div>
-              <div className="d-flex justify-content-between"><span>Low stock SKUs</span><strong>{lowStock.length}</strong></div>
-              <div className="d-flex justify-content-between"><span>Active products</span><strong>{activeProducts}</strong></div>
+              <div className="d-flex justify-content-between"><span>Low stock SKUs</span><strong>{stock.lowStockCount ?? 0}</strong></div>
+              <div className="d-flex justify-content-between"><span>Out of stock</span><strong>{stock.outOfStockCount ?? 0}</strong></div>
             </Card.Body>
           </Card>
           <Card className="shadow-sm mt-3">
             <Card.Header>Paid vs Unpaid</Card.Header>
             <Card.Body className="d-flex justify-content-center">
-              <Donut paid={paidCount} total={ordersInRange.length} />
+              <Donut paid={paidCount} total={orderCount} />
             </Card.Body>
           </Card>
         </Col>
@@ -291,14 +235,14 @@ export default function DashboardAdmin() {
               <Table hover responsive className="mb-0">
                 <thead><tr><th>ID</th><th>Date</th><th>Total</th><th>Paid</th><th>Delivered</th><th /></tr></thead>
                 <tbody>
-                  {ordersInRange.slice(0, 8).map(o => (
-                    <tr key={o._id || o.id}>
-                      <td className="text-monospace">{o._id || o.id}</td>
-                      <td>{new Date(o.createdAt || o.created_at).toLocaleDateString?.() || '-'}</td>
-                      <td>${(o.totalPrice ?? o.total_price ?? 0).toFixed(2)}</td>
-                      <td>{(o.isPaid || o.paidAt) ? <Badge bg="success">Yes</Badge> : <Badge bg="secondary">No</Badge>}</td>
-                      <td>{(o.isDelivered || o.deliveredAt) ? <Badge bg="dark">Yes</Badge> : <Badge bg="warning" text="dark">No</Badge>}</td>
-                      <td className="text-end"><Button as={Link} to={`/order/${o._id || o.id}`} size="sm" variant="light">View</Button></td>
+                  {(data?.recentOrders || []).slice(0, 8).map(o => (
+                    <tr key={o._id}>
+                      <td className="text-monospace">{o._id}</td>
+                      <td>{new Date(o.createdAt).toLocaleDateString?.() || '-'}</td>
+                      <td>${Number(o.totalPrice ?? 0).toFixed(2)}</td>
+                      <td>{o.isPaid ? <Badge bg="success">Yes</Badge> : <Badge bg="secondary">No</Badge>}</td>
+                      <td>{o.isDelivered ? <Badge bg="dark">Yes</Badge> : <Badge bg="warning" text="dark">No</Badge>}</td>
+                      <td className="text-end"><Button as={Link} to={`/order/${o._id}`} size="sm" variant="light">View</Button></td>
                     </tr>
                   ))}
                 </tbody>
@@ -313,11 +257,11 @@ export default function DashboardAdmin() {
               <Table hover responsive className="mb-0">
                 <thead><tr><th>Name</th><th>Email</th><th /></tr></thead>
                 <tbody>
-                  {(data.users || []).slice(0, 8).map(u => (
-                    <tr key={u._id || u.id}>
-                      <td>{u.name || u.username || '-'}</td>
+                  {(data?.recentUsers || []).slice(0, 8).map(u => (
+                    <tr key={u.id}>
+                      <td>{u.name || '-'}</td>
                       <td><a className="text-decoration-none" href={`mailto:${u.email}`}>{u.email}</a></td>
-                      <td className="text-end"><Button as={Link} to={`/admin/user/${u._id || u.id}`} size="sm" variant="light">Edit</Button></td>
+                      <td className="text-end"><Button as={Link} to={`/admin/user/${u.id}`} size="sm" variant="light">Edit</Button></td>
                     </tr>
                   ))}
                 </tbody>
@@ -330,16 +274,16 @@ export default function DashboardAdmin() {
       <Row className="g-3 mt-1">
         <Col>
           <Card className="shadow-sm">
-            <Card.Header>Top Products</Card.Header>
+            <Card.Header>Top Products (30 days)</Card.Header>
             <Card.Body className="p-0">
               <Table hover responsive className="mb-0">
                 <thead><tr><th>Name</th><th>Qty</th><th>Revenue</th></tr></thead>
                 <tbody>
                   {topProducts.map(p => (
-                    <tr key={p.name}>
-                      <td>{p.name}</td>
-                      <td>{p.qty}</td>
-                      <td>${p.revenue.toFixed(2)}</td>
+                    <tr key={p.product_id ?? p.name}>
+                      <td>{p.name || '-'}</td>
+                      <td>{p.units}</td>
+                      <td>${Number(p.revenue || 0).toFixed(2)}</td>
                     </tr>
                   ))}
                 </tbody>
@@ -358,9 +302,9 @@ export default function DashboardAdmin() {
                 <thead><tr><th>Name</th><th>Stock</th><th /></tr></thead>
                 <tbody>
                   {lowStock.map(p => (
-                    <tr key={p._id || p.id}>
+                    <tr key={p._id}>
                       <td>{p.name}</td>
-                      <td><Badge bg={p.countInStock < 3 ? 'danger' : 'warning'} text={p.countInStock < 3 ? undefined : 'dark'}>{p.countInStock}</Badge></td>
+                      <td><Badge bg={p.available < 3 ? 'danger' : 'warning'} text={p.available < 3 ? undefined : 'dark'}>{p.available}</Badge></td>
                       <td className="text-end"><Button as={Link} to={`/admin/products`} size="sm" variant="light">Restock</Button></td>
                     </tr>
                   ))}
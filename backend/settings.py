@@ -3,6 +3,7 @@ from pathlib import Path
 from datetime import timedelta
 import dj_database_url
 import environ
+from corsheaders.defaults import default_headers as default_cors_headers
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -29,11 +30,18 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'base.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',  # Allow any access by default
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'base.renderers.FastJSONRenderer',  # orjson-backed JSONRenderer
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Render's proxy appends the client address to X-Forwarded-For; throttles
+    # key on that entry instead of whatever the client put in front of it
+    'NUM_PROXIES': env.int('NUM_PROXIES', default=1),
 }
 
 LOGGING = {
@@ -63,15 +71,23 @@ LOGGING = {
 }
 
 
+# The base.middleware versions skip their work for API_PREFIX requests (JWT
+# only, no sessions, messages, CSRF or static files); /admin/ is unchanged.
+API_PREFIX = '/api/'
+# API responses at least this big are sent gzip or brotli encoded when the
+# client accepts it; brotli needs the Brotli package and falls back to gzip
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_BROTLI_QUALITY = 5
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Serve static files efficiently
+    'base.middleware.CompressionMiddleware',  # gzip/brotli for API responses
+    'base.middleware.WhiteNoiseMiddleware',  # Serve static files efficiently
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'base.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'base.middleware.CsrfViewMiddleware',
+    'base.middleware.AuthenticationMiddleware',
+    'base.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -102,8 +118,11 @@ if not DB_URL:
     raise RuntimeError(
         "Set SUPABASE_DB_URL or DATABASE_URL to your Supabase Postgres URL (include ?sslmode=require)."
     )
+# The app runs under ASGI (see Procfile), where each request's sync code gets
+# its own thread; persistent connections would pile up one per thread and
+# never be reused, so connections are closed at the end of each request
 DATABASES = {
-    'default': dj_database_url.parse(DB_URL, conn_max_age=600, ssl_require=True)
+    'default': dj_database_url.parse(DB_URL, conn_max_age=env.int('CONN_MAX_AGE', default=0), ssl_require=True)
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -162,6 +181,59 @@ STORAGES = {
     },
 }
 
+# Caching. Local memory by default; set CACHE_URL (redis://...) to share the
+# cache between workers. Catalog pages and authenticated users are cached in
+# local memory only while the app runs as a single process, since
+# invalidating them must reach every worker. gunicorn starts WEB_CONCURRENCY
+# workers, so SINGLE_PROCESS follows it unless set explicitly.
+CACHE_URL = env('CACHE_URL', default=None)
+SINGLE_PROCESS = env.bool('SINGLE_PROCESS', default=env.int('WEB_CONCURRENCY', default=1) == 1)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'handmadehub',
+    },
+}
+if CACHE_URL:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    }
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = env.int('CATALOG_CACHE_TIMEOUT', default=300)
+# Authenticated users are resolved from the cache for up to this long (seconds)
+AUTH_USER_CACHE_TIMEOUT = env.int('AUTH_USER_CACHE_TIMEOUT', default=60)
+# The admin dashboard summary is recomputed at most this often (seconds)
+DASHBOARD_CACHE_TIMEOUT = env.int('DASHBOARD_CACHE_TIMEOUT', default=30)
+
+# Checkout stock holds expire after this long unless the order is paid
+STOCK_HOLD_TTL_MINUTES = env.int('STOCK_HOLD_TTL_MINUTES', default=15)
+# Checkout and availability reads release lapsed holds at most this often
+STOCK_SWEEP_INTERVAL_SECONDS = 60
+
+# Idempotency-Key replays are kept this long
+IDEMPOTENCY_KEY_TTL_HOURS = env.int('IDEMPOTENCY_KEY_TTL_HOURS', default=24)
+
+# Order status events for the SSE stream. With a Redis URL every worker
+# receives every event; without one events only reach the publishing process.
+ORDER_EVENTS_URL = env('ORDER_EVENTS_URL', default=CACHE_URL)
+ORDER_EVENTS_BACKEND = 'base.events.RedisBackend' if ORDER_EVENTS_URL else 'base.events.LocalBackend'
+ORDER_EVENTS_HEARTBEAT_SECONDS = env.int('ORDER_EVENTS_HEARTBEAT_SECONDS', default=15)
+# Lifetime of the stream tokens EventSource clients pass as ?token=
+ORDER_EVENTS_TOKEN_SECONDS = 120
+
+# Token-bucket throttles ('N/period' = burst of N, refilled at N per period).
+# Buckets live in process memory unless THROTTLE_URL points at Redis.
+THROTTLE_RATES = {
+    'login': env('THROTTLE_LOGIN', default='10/min'),
+    'login_failures': env('THROTTLE_LOGIN_FAILURES', default='5/min'),
+    'register': env('THROTTLE_REGISTER', default='5/min'),
+    'search': env('THROTTLE_SEARCH', default='60/min'),
+    'checkout': env('THROTTLE_CHECKOUT', default='20/min'),
+}
+THROTTLE_URL = env('THROTTLE_URL', default=None)
+THROTTLE_BACKEND = 'base.throttling.RedisBuckets' if THROTTLE_URL else 'base.throttling.LocalBuckets'
+
 # CORS settings for API access
 CORS_ALLOWED_ORIGINS = env.list('CORS_ALLOWED_ORIGINS', default=[
     "https://handmadehub.onrender.com",
@@ -171,6 +243,8 @@ CORS_ALLOWED_ORIGINS = env.list('CORS_ALLOWED_ORIGINS', default=[
     "http://127.0.0.1:8000",
 ])
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_cors_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 # CSRF trusted origins (use scheme + host)
 CSRF_TRUSTED_ORIGINS = env.list('CSRF_TRUSTED_ORIGINS', default=[
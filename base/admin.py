@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product, Review, Order, OrderItem, ShippingAddress, ProductVariant, ProductMedia, Collection, CollectionEntry, ProductMediaLink
+from .models import Product, Review, Order, OrderItem, ShippingAddress, ProductVariant, ProductMedia, Collection, CollectionEntry, ProductMediaLink, StockReservation, OrderDailyRollup
 
 # Register your models here.
 
@@ -13,3 +13,5 @@ admin.site.register(ProductMedia)
 admin.site.register(Collection)
 admin.site.register(CollectionEntry)
 admin.site.register(ProductMediaLink)
+admin.site.register(StockReservation)
+admin.site.register(OrderDailyRollup)
@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+
+from base.cache import get_cache, is_shared
+
+# Only these columns are cached. The user is rebuilt with the rest deferred,
+# so a view that saves request.user only writes what it loaded or changed
+# and never clobbers the password or other uncached columns.
+# Listed in model field order, which Model.from_db expects.
+CACHED_FIELDS = [
+    f.attname for f in User._meta.concrete_fields
+    if f.attname in {'id', 'username', 'email', 'first_name', 'last_name', 'is_staff', 'is_superuser', 'is_active'}
+]
+
+
+def user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def invalidate_user(user_id):
+    # Drop again on commit so a request that read the old row mid-transaction
+    # cannot leave it cached
+    get_cache().delete(user_key(user_id))
+    transaction.on_commit(lambda: get_cache().delete(user_key(user_id)))
+
+
+def cached_user(user_id):
+    """The user for user_id from the cache, or from the database (and then
+    cached for AUTH_USER_CACHE_TIMEOUT seconds). None if there is no such user.
+    Only a shared cache is used (see base.cache.is_shared): invalidate_user
+    cannot reach another worker's local memory, where a demoted or deleted
+    user would linger."""
+    cache = get_cache()
+    shared = is_shared(cache)
+    key = user_key(user_id)
+    values = cache.get(key) if shared else None
+    if values is None:
+        values = User.objects.filter(id=user_id).values_list(*CACHED_FIELDS).first()
+        if values is None:
+            return None
+        if shared:
+            cache.set(key, values, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60))
+    return User.from_db('default', CACHED_FIELDS, values)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the token's user without a query on
+    cache hits. Claims alone are not trusted for identity: access tokens
+    live for weeks and could not be recalled on demotion or deletion."""
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Revocation compares against the password hash, which is not cached
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        user = cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
+
+
+class EventStreamToken(Token):
+    """Short-lived token that only opens the order event stream. EventSource
+    cannot send headers, so this is what goes in the ?token= query string,
+    where URLs end up in access logs and proxies; access tokens never do."""
+    token_type = 'event_stream'
+    lifetime = timedelta(seconds=getattr(settings, 'ORDER_EVENTS_TOKEN_SECONDS', 120))
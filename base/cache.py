@@ -0,0 +1,87 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+# Every cached catalog response embeds the current catalog version in its key.
+# Bumping the version on writes orphans all old entries at once, so stale pages
+# are never served and there is no need to track which keys to delete.
+# That only holds when every worker shares the cache: a bump in a per-process
+# LocMemCache never reaches the other workers, so with several workers catalog
+# pages (and cached users, see base.authentication) need a shared backend.
+VERSION_KEY = 'catalog:version'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def is_shared(cache=None):
+    """Whether all workers see the same entries, so that invalidating in one
+    worker invalidates everywhere: a Redis, memcached or file cache, or local
+    memory when there is only one worker (SINGLE_PROCESS)."""
+    if isinstance(cache or get_cache(), LocMemCache):
+        return getattr(settings, 'SINGLE_PROCESS', False)
+    return True
+
+
+def _record(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        data = dict(_stats)
+    lookups = data['hits'] + data['misses']
+    data['hitRate'] = round(data['hits'] / lookups, 4) if lookups else 0.0
+    data['backend'] = get_cache().__class__.__name__
+    data['shared'] = is_shared()
+    return data
+
+
+def get_catalog_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a version evicted from the cache can never be reused
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+    _record('invalidations')
+
+
+def catalog_key(*parts):
+    raw = ':'.join(str(p) for p in parts)
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return f'catalog:{get_catalog_version()}:{digest}'
+
+
+def cached_catalog_response(key, build):
+    """Return the cached payload for key, or build it and store it. Without
+    a shared cache the payload is always built."""
+    cache = get_cache()
+    if not is_shared(cache):
+        return build()
+    data = cache.get(key)
+    if data is not None:
+        _record('hits')
+        return data
+    _record('misses')
+    data = build()
+    cache.set(key, data, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+    return data
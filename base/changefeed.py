@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.models import F
+
+from base.models import ChangeSequence
+
+# Incremental sync: every order write is stamped with the next value of a
+# counter. The stamp runs in its own short transaction right after the write
+# commits, so the counter row is locked only for that instant rather than for
+# a whole checkout, and sequence order is still the order stamps commit in. A
+# client that asks for rows above the last value it saw never skips a change:
+# a committed row that is not stamped yet just shows up on a later sync.
+MAX_CHANGES = 500
+
+
+def next_change_seq(name='order'):
+    counter = ChangeSequence.objects.filter(name=name)
+    if not counter.update(value=F('value') + 1):
+        ChangeSequence.objects.get_or_create(name=name)
+        counter.update(value=F('value') + 1)
+    return counter.values_list('value', flat=True).get()
+
+
+def stamp_change(instance, name='order'):
+    """Set instance.changeSeq (row and object) once the current transaction
+    commits; immediately when there is none."""
+    model, pk = type(instance), instance.pk
+
+    def stamp():
+        with transaction.atomic():
+            seq = next_change_seq(name)
+            model.objects.filter(pk=pk).update(changeSeq=seq)
+        instance.changeSeq = seq
+
+    transaction.on_commit(stamp)
+
+
+def parse_since(value):
+    try:
+        since = int(value or 0)
+    except ValueError:
+        raise ValueError('Invalid since cursor')
+    if since < 0:
+        raise ValueError('Invalid since cursor')
+    return since
+
+
+def changes_since(queryset, since, limit=100):
+    """Rows changed after `since`, oldest change first, at most `limit`.
+    Returns (rows, cursor, has_more); pass cursor back as the next since."""
+    limit = min(max(limit, 1), MAX_CHANGES)
+    # Annotated so a sparse .only() upstream cannot defer it
+    changed = queryset.annotate(change_seq=F('changeSeq')).filter(changeSeq__gt=since)
+    rows = list(changed.order_by('changeSeq')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = rows[-1].change_seq if rows else since
+    return rows, str(cursor), has_more
@@ -0,0 +1,32 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def list_validators(queryset):
+    """(latest updatedAt, row count) for a filtered queryset in one aggregate
+    query; the count catches deletions that do not move the max."""
+    agg = queryset.order_by().aggregate(last=Max('updatedAt'), n=Count('pk'))
+    return agg['last'], agg['n']
+
+
+def conditional(request, build, last_modified, *etag_parts, private=False):
+    """Answer If-None-Match / If-Modified-Since with a 304 before build() is
+    called; otherwise return build()'s response with ETag and Last-Modified."""
+    raw = '|'.join(str(p) for p in (request.build_absolute_uri(), last_modified, *etag_parts))
+    etag = '"%s"' % hashlib.md5(raw.encode('utf-8')).hexdigest()
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+    # Make browsers revalidate instead of heuristically reusing a stale copy
+    patch_cache_control(response, no_cache=True, private=private)
+    return response
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.utils import timezone
+
+from base.cache import get_cache
+from base.models import Order, OrderItem, Product, ProductVariant
+from base.reservations import with_available
+from base.rollups import order_series, range_totals
+from base.serializers import OrderSummarySerializer
+
+SUMMARY_KEY = 'dashboard:summary'
+KPI_RANGES = {'today': 1, 'week': 7, 'month': 30, 'quarter': 90, 'year': 365}
+LOW_STOCK = 5
+LIST_SIZE = 10
+TOP_PRODUCTS = 5
+TOP_PRODUCTS_DAYS = 30
+
+
+def build_summary():
+    """Every dashboard figure from a fixed number of aggregate queries."""
+    statuses = Order.objects.aggregate(
+        total=Count('pk'),
+        awaitingPayment=Count('pk', filter=Q(status='pending')),
+        paid=Count('pk', filter=Q(isPaid=True)),
+        awaitingDelivery=Count('pk', filter=Q(status='paid')),
+        delivered=Count('pk', filter=Q(isDelivered=True)),
+        refunded=Count('pk', filter=Q(status='refunded')),
+    )
+    users = User.objects.aggregate(total=Count('pk'), staff=Count('pk', filter=Q(is_staff=True)))
+    # Held units are not for sale, so thresholds apply to countInStock - reservedStock
+    low = with_available(Product.objects.all()).filter(available__lt=LOW_STOCK)
+    stock = low.aggregate(
+        lowStockCount=Count('pk', filter=Q(available__gt=0)),
+        outOfStockCount=Count('pk', filter=Q(available__lte=0)),
+    )
+    low_products = low.order_by('available', '_id').values(
+        '_id', 'name', 'countInStock', 'reservedStock', 'available')[:LIST_SIZE]
+    low_variants = ProductVariant.objects.annotate(available=F('stock') - F('reserved')).filter(
+        available__lt=LOW_STOCK).order_by('available', 'id').values(
+        'id', 'sku', 'size', 'color', 'stock', 'reserved', 'available',
+        productId=F('product_id'), productName=F('product__name'))[:LIST_SIZE]
+    recent = OrderSummarySerializer.setup_eager_loading(Order.objects.order_by('-createdAt', '-_id'))[:LIST_SIZE]
+    recent_users = User.objects.order_by('-date_joined', '-id').values(
+        'id', 'email', name=F('first_name'))[:LIST_SIZE]
+    since = timezone.now() - timedelta(days=TOP_PRODUCTS_DAYS)
+    top_products = OrderItem.objects.filter(order__createdAt__gte=since).values('product_id').annotate(
+        name=F('product__name'), units=Sum('qty'),
+        revenue=Sum(F('price') * F('qty'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+    ).order_by('-revenue')[:TOP_PRODUCTS]
+
+    return {
+        'generatedAt': timezone.now(),
+        'kpis': range_totals(KPI_RANGES),
+        # Daily series for the revenue chart, read from the rollups
+        'revenue': [{'day': row['period'], 'sales': row['sales'], 'orderCount': row['orderCount']}
+                    for row in order_series(KPI_RANGES['year'])],
+        'orders': statuses,
+        'users': users,
+        'stock': {
+            **stock,
+            'lowStockProducts': list(low_products),
+            'lowStockVariants': list(low_variants),
+        },
+        'recentOrders': OrderSummarySerializer(recent, many=True).data,
+        'recentUsers': list(recent_users),
+        'topProducts': list(top_products),
+    }
+
+
+def dashboard_summary():
+    """The summary, recomputed at most every DASHBOARD_CACHE_TIMEOUT seconds."""
+    cache = get_cache()
+    data = cache.get(SUMMARY_KEY)
+    if data is None:
+        data = build_summary()
+        cache.set(SUMMARY_KEY, data, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 30))
+    return data
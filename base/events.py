@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Order status events. Views publish after commit; every process keeps one
+# in-memory Hub that fans messages out to its open SSE connections, and a
+# backend decides how publishes reach the hubs: LocalBackend delivers in
+# process (single worker / development), RedisBackend relays through Redis
+# pub/sub so every worker sees every event.
+ADMIN_CHANNEL = 'orders.admin'
+QUEUE_SIZE = 100
+
+
+def user_channel(user_id):
+    return f'orders.user.{user_id}'
+
+
+def _offer(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        # A stalled client misses events; it resyncs from Last-Event-ID on reconnect
+        pass
+
+
+class Subscription:
+    def __init__(self, hub, channels):
+        self.hub = hub
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    async def get(self, timeout):
+        """Next message, or None if nothing arrived within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class Hub:
+    """In-process fan-out from channels to subscriber queues. publish() is
+    thread-safe; each queue is fed on its own event loop."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers[channel].discard(subscription)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, ()))
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(_offer, subscription.queue, message)
+            except RuntimeError:
+                # Loop already closed; the connection is going away
+                pass
+
+
+class LocalBackend:
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, channel, message):
+        self.hub.publish(channel, message)
+
+    def start(self):
+        pass
+
+
+class RedisBackend:
+    """Publishes to Redis and runs one listener thread per process that
+    feeds the local hub. Uses ORDER_EVENTS_URL, falling back to CACHE_URL."""
+
+    def __init__(self, hub):
+        import redis
+
+        self.hub = hub
+        url = getattr(settings, 'ORDER_EVENTS_URL', None) or getattr(settings, 'CACHE_URL', None)
+        self.client = redis.Redis.from_url(url)
+        self._started = False
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        self.client.publish(channel, json.dumps(message, cls=DjangoJSONEncoder))
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._listen, name='order-events', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe('orders.*')
+                for item in pubsub.listen():
+                    self.hub.publish(item['channel'].decode(), json.loads(item['data']))
+            except Exception as e:
+                logger.error(f"Order event listener failed: {str(e)}")
+                threading.Event().wait(1)
+
+
+hub = Hub()
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    path = getattr(settings, 'ORDER_EVENTS_BACKEND', 'base.events.LocalBackend')
+    return import_string(path)(hub)
+
+
+def order_message(order, event):
+    return {
+        'event': event,
+        'orderId': order._id,
+        'status': order.status,
+        'isPaid': order.isPaid,
+        'paidAt': order.paidAt,
+        'isDelivered': order.isDelivered,
+        'deliveredAt': order.deliveredAt,
+        'refundTotal': order.refundTotal,
+        'changeSeq': order.changeSeq,
+    }
+
+
+def publish_order_event(order, event):
+    """Announce a status transition to the owner and to admins once the
+    surrounding transaction commits. The message is built then, after the
+    change feed has stamped the order's changeSeq."""
+    channels = [ADMIN_CHANNEL] + ([user_channel(order.user_id)] if order.user_id else [])
+
+    def send():
+        message = json.loads(json.dumps(order_message(order, event), cls=DjangoJSONEncoder))
+        backend = get_backend()
+        for channel in channels:
+            try:
+                backend.publish(channel, message)
+            except Exception as e:
+                logger.error(f"Failed to publish order event: {str(e)}")
+
+    transaction.on_commit(send)
@@ -0,0 +1,136 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from base.models import Order
+
+# (column, lookup) pairs; one exported row per order item, orders without
+# items still get one row with empty item columns
+COLUMNS = [
+    ('orderId', '_id'),
+    ('createdAt', 'createdAt'),
+    ('userEmail', 'user__email'),
+    ('status', 'status'),
+    ('paymentMethod', 'paymentMethod'),
+    ('taxPrice', 'taxPrice'),
+    ('shippingPrice', 'shippingPrice'),
+    ('totalPrice', 'totalPrice'),
+    ('isPaid', 'isPaid'),
+    ('paidAt', 'paidAt'),
+    ('isDelivered', 'isDelivered'),
+    ('deliveredAt', 'deliveredAt'),
+    ('refundTotal', 'refundTotal'),
+    ('address', 'shippingaddress__address'),
+    ('city', 'shippingaddress__city'),
+    ('postalCode', 'shippingaddress__postalCode'),
+    ('country', 'shippingaddress__country'),
+    ('itemId', 'orderitem___id'),
+    ('productId', 'orderitem__product'),
+    ('itemName', 'orderitem__name'),
+    ('qty', 'orderitem__qty'),
+    ('price', 'orderitem__price'),
+]
+HEADER = [column for column, _ in COLUMNS]
+CHUNK_SIZE = 2000
+
+
+def parse_bound(value, end=False):
+    """ISO date or datetime query value -> aware datetime. A bare `to` date
+    covers that whole day."""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value}')
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_orders(queryset, params):
+    """Order filters shared by the admin list and exports: status, isPaid,
+    isDelivered, from, to, user. Raises ValueError on bad values."""
+    if params.get('status'):
+        if params['status'] not in dict(Order.STATUS_CHOICES):
+            raise ValueError(f"Invalid status: {params['status']}")
+        queryset = queryset.filter(status=params['status'])
+    for flag in ('isPaid', 'isDelivered'):
+        value = params.get(flag)
+        if value in ('true', '1'):
+            queryset = queryset.filter(**{flag: True})
+        elif value in ('false', '0'):
+            queryset = queryset.filter(**{flag: False})
+    start = parse_bound(params.get('from'))
+    end = parse_bound(params.get('to'), end=True)
+    if start:
+        queryset = queryset.filter(createdAt__gte=start)
+    if end:
+        queryset = queryset.filter(createdAt__lt=end)
+    if params.get('user'):
+        queryset = queryset.filter(user_id=int(params['user']))
+    return queryset
+
+
+def export_rows(orders, chunk_size=CHUNK_SIZE):
+    """Flat tuples for the orders, fetched chunk by chunk (a server-side
+    cursor on PostgreSQL) so memory does not grow with the export."""
+    lookups = [lookup for _, lookup in COLUMNS]
+    return orders.order_by('_id', 'orderitem___id').values_list(*lookups).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line straight back
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        yield writer.writerow([_cell(v) for v in row])
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(HEADER, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def _next_chunk(lines, size):
+    return ''.join(islice(lines, size))
+
+
+async def async_chunks(lines, size=CHUNK_SIZE):
+    """Async iterator over a line generator for ASGI responses. Django reads a
+    sync iterator there with sync_to_async(list), which would load the whole
+    export into memory; this pulls `size` lines per hop to the request's sync
+    thread (the one holding the database cursor) instead."""
+    while True:
+        chunk = await sync_to_async(_next_chunk)(lines, size)
+        if not chunk:
+            return
+        yield chunk
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
@@ -0,0 +1,93 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from base.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+# Seconds a duplicate of an in-flight request is told to wait before retrying
+RETRY_AFTER = 1
+# A claim still unfinished after this long belongs to a crashed worker
+ABANDONED_AFTER = timedelta(minutes=2)
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def _claim(user, key, scope, fingerprint):
+    """Return (record, created). Exactly one concurrent caller creates the row."""
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    now = timezone.now()
+    if record is not None:
+        stale = record.expiresAt <= now or (
+            record.responseStatus is None and record.createdAt <= now - ABANDONED_AFTER)
+        if not stale:
+            return record, False
+        IdempotencyKey.objects.filter(pk=record.pk).delete()
+    ttl = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, scope=scope, fingerprint=fingerprint, expiresAt=now + ttl), True
+    except IntegrityError:
+        return IdempotencyKey.objects.get(user=user, key=key), False
+
+
+def _replay(record):
+    return Response(record.responseBody, status=record.responseStatus, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view):
+    """Honour an Idempotency-Key header on a write view. The first request
+    runs the view and stores its response; retries with the same key get
+    that response back, and duplicates arriving while it still runs get an
+    immediate 409 with Retry-After rather than holding a worker. 5xx
+    responses are not stored."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'detail': f'{HEADER} is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        scope = f'{request.method} {request.path}'
+        fingerprint = _fingerprint(request)
+        user = request.user if request.user.is_authenticated else None
+        record, created = _claim(user, key, scope, fingerprint)
+        if not created:
+            if record.scope != scope or record.fingerprint != fingerprint:
+                return Response({'detail': f'{HEADER} was already used for a different request'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record.responseStatus is None:
+                return Response({'detail': 'A request with this key is still in progress'},
+                                status=status.HTTP_409_CONFLICT, headers={'Retry-After': str(RETRY_AFTER)})
+            return _replay(record)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+            raise
+        if response.status_code >= 500 or not hasattr(response, 'data'):
+            # Let the client retry server errors for real
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+        else:
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                responseStatus=response.status_code, responseBody=response.data)
+        return response
+    return wrapper
+
+
+def purge_expired(now=None):
+    return IdempotencyKey.objects.filter(expiresAt__lte=now or timezone.now()).delete()[0]
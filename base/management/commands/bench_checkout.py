@@ -0,0 +1,90 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from base.models import Order, OrderItem, Product
+from base.views.order_views import addOrderItems
+
+
+class Command(BaseCommand):
+    help = ('Concurrency benchmark: many parallel checkouts against a single SKU, '
+            'run on a throwaway test database. Reports orders/sec and checks for overselling.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--orders', type=int, default=400, help='Total checkout attempts')
+        parser.add_argument('--stock', type=int, default=250, help='Initial stock of the contended SKU')
+        parser.add_argument('--qty', type=int, default=1, help='Units per checkout')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            # Threads need a shared file database and writers that queue instead of failing fast
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench_checkout.sqlite3')
+            connection.settings_dict['OPTIONS'].update({'transaction_mode': 'IMMEDIATE', 'timeout': 60})
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # Measure the write path, not the per-user checkout throttle
+            with override_settings(THROTTLE_RATES={}):
+                self.run_benchmark(**options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_benchmark(self, workers, orders, stock, qty, **kwargs):
+        product = Product.objects.create(name='Contended SKU', price=10, countInStock=stock)
+        users = [User.objects.create(username=f'bench{i}') for i in range(workers)]
+        payload = {
+            'orderItems': [{'product': product._id, 'qty': qty, 'price': '10.00'}],
+            'paymentMethod': 'PayPal', 'taxPrice': '0.00', 'shippingPrice': '0.00', 'totalPrice': '10.00',
+            'shippingAddress': {'address': '1 Main', 'city': 'X', 'postalCode': '1', 'country': 'US'},
+        }
+        factory = APIRequestFactory()
+        results = {'ok': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        attempts = iter(range(orders))
+        start_gate = threading.Barrier(workers)
+
+        def worker(user):
+            start_gate.wait()
+            try:
+                while True:
+                    with lock:
+                        if next(attempts, None) is None:
+                            return
+                    request = factory.post('/api/orders/add/', payload, format='json')
+                    force_authenticate(request, user=user)
+                    status_code = addOrderItems(request).status_code
+                    outcome = 'ok' if status_code == 200 else 'rejected' if status_code == 400 else 'errors'
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(u,)) for u in users]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        product.refresh_from_db()
+        # Checkout holds stock until payment, so "sold" here means held by an order
+        sold = OrderItem.objects.filter(product=product).aggregate(n=Sum('qty'))['n'] or 0
+        oversold = sold > stock or product.reservedStock != sold or product.countInStock != stock
+
+        self.stdout.write(f'backend:      {connection.vendor}, {workers} workers, {orders} attempts x {qty} unit(s)')
+        self.stdout.write(f'completed:    {results["ok"]} orders, {results["rejected"]} rejected (out of stock), {results["errors"]} errors')
+        self.stdout.write(f'throughput:   {results["ok"] / elapsed:.1f} orders/sec ({orders / elapsed:.1f} attempts/sec)')
+        self.stdout.write(f'stock:        {stock} in stock, {product.reservedStock} held, units ordered {sold}, orders {Order.objects.count()}')
+        if oversold:
+            self.stdout.write(self.style.ERROR('OVERSOLD'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No overselling'))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from base.media_urls import _resolve, media_url
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark: per-image URL cost of storage.url + build_absolute_uri versus base.media_urls.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=2000, help='Distinct file names per run')
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        names = [f'product_media/look-{i:05d}.jpg' for i in range(options['items'])]
+
+        def storage_path(request):
+            for name in names:
+                request.build_absolute_uri(default_storage.url(name))
+
+        def resolver_path(request):
+            for name in names:
+                media_url(name, request)
+
+        self.stdout.write(f'storage backend: {default_storage.__class__.__name__}')
+        for label, fn in (('storage.url', storage_path), ('media_url', resolver_path)):
+            best = None
+            for _ in range(options['rounds']):
+                # A fresh request per round, as each API call gets its own
+                request = RequestFactory().get('/api/products/', HTTP_HOST='localhost')
+                # and start cold, so rounds after the first measure URL building, not cache hits
+                _resolve.cache_clear()
+                start = time.perf_counter()
+                fn(request)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write(f'{label:>12}: {best / len(names) * 1e6:8.2f} us/item')
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import path
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+# MIDDLEWARE as it was before the API bypass, for comparison
+STOCK_MIDDLEWARE = [
+    'corsheaders.middleware.CorsMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+
+@api_view(['GET'])
+def ping(request):
+    return Response({'ok': True})
+
+
+# A view with no database work, so the timings are the request pipeline itself
+urlpatterns = [path('api/ping/', ping)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark: per-request overhead of an /api/ call with the stock middleware versus base.middleware.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+
+        configs = (('stock', STOCK_MIDDLEWARE), ('lean', settings.MIDDLEWARE))
+        results = {}
+        overrides = {'ROOT_URLCONF': __name__, 'ALLOWED_HOSTS': ['testserver'], 'SECURE_SSL_REDIRECT': False}
+        for label, middleware in configs:
+            with override_settings(MIDDLEWARE=middleware, **overrides):
+                client = Client()
+                client.get('/api/ping/')  # build the middleware chain
+                best = None
+                for _ in range(options['rounds']):
+                    start = time.perf_counter()
+                    for _ in range(options['requests']):
+                        client.get('/api/ping/')
+                    elapsed = (time.perf_counter() - start) / options['requests']
+                    best = elapsed if best is None else min(best, elapsed)
+            results[label] = best
+            self.stdout.write(f'{label:>6}: {best * 1e6:8.1f} us/request')
+        saved = results['stock'] - results['lean']
+        self.stdout.write(f' saved: {saved * 1e6:8.1f} us/request ({saved / results["stock"]:.0%})')
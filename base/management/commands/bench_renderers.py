@@ -0,0 +1,97 @@
+import gzip
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from base.middleware import brotli
+from base.models import Order, OrderItem, Product, Review, ShippingAddress
+from base.renderers import FastJSONRenderer, orjson
+from base.views.order_views import getOrders
+from base.views.product_views import getProducts
+
+
+class Command(BaseCommand):
+    help = ('Benchmark: render time and bytes on the wire of the getOrders and getProducts '
+            'payloads with the stock JSONRenderer versus base.renderers, on a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--items', type=int, default=3, help='Items per order')
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(THROTTLE_RATES={}, ALLOWED_HOSTS=['testserver']):
+                self.run_benchmark(**options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, orders, items, products):
+        admin = User.objects.create(username='bench-admin', email='admin@example.com', is_staff=True)
+        users = [User.objects.create(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(20)]
+        catalog = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=Decimal('19.99') + i,
+                    countInStock=100, rating=Decimal('4.50'), numReviews=5,
+                    description='A product used to size API payloads. ' * 4)
+            for i in range(products)
+        )
+        Review.objects.bulk_create(
+            Review(product=p, user=u, name=u.username, rating=5, comment='Does what it says.')
+            for p in catalog for u in users[:5]
+        )
+        for i in range(orders):
+            order = Order.objects.create(user=users[i % len(users)], paymentMethod='PayPal', taxPrice=Decimal('1.60'),
+                                         shippingPrice=Decimal('5.00'), totalPrice=Decimal('66.57'))
+            OrderItem.objects.bulk_create(
+                OrderItem(product=p, order=order, name=p.name, qty=1, price=p.price)
+                for p in catalog[i % products:i % products + items]
+            )
+            ShippingAddress.objects.create(order=order, address='1 Main St', city='Springfield', postalCode='12345', country='US')
+        return admin
+
+    def payloads(self, admin, products):
+        factory = APIRequestFactory()
+        request = factory.get('/api/orders/')
+        force_authenticate(request, user=admin)
+        yield 'getOrders', [getOrders(request).data]
+        pages = []
+        for page in range(1, (products + 7) // 8 + 1):
+            pages.append(getProducts(factory.get('/api/products/', {'page': page, 'expand': 'reviews'})).data)
+        yield f'getProducts x{len(pages)} pages', pages
+
+    def timed(self, renderer, payloads, rounds):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for data in payloads:
+                renderer.render(data, 'application/json', {})
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def run_benchmark(self, orders, items, products, rounds, **kwargs):
+        admin = self.seed(orders, items, products)
+        if orjson is None:
+            self.stdout.write('orjson is not installed; FastJSONRenderer falls back to JSONRenderer')
+        stock, fast = JSONRenderer(), FastJSONRenderer()
+        for label, payloads in self.payloads(admin, products):
+            body = [fast.render(data, 'application/json', {}) for data in payloads]
+            raw = sum(len(b) for b in body)
+            gz = sum(len(gzip.compress(b)) for b in body)
+            br = sum(len(brotli.compress(b, quality=settings.COMPRESSION_BROTLI_QUALITY)) for b in body) if brotli else None
+            stock_time = self.timed(stock, payloads, rounds)
+            fast_time = self.timed(fast, payloads, rounds)
+            self.stdout.write(label)
+            self.stdout.write(f'  render: {stock_time * 1e3:8.2f} ms stock, {fast_time * 1e3:8.2f} ms fast '
+                              f'({stock_time / fast_time:.1f}x)')
+            self.stdout.write(f'   bytes: {raw:>9,} raw, {gz:>9,} gzip ({gz / raw:.0%})'
+                              + (f', {br:>9,} br ({br / raw:.0%})' if br is not None else ', br unavailable'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from base.exports import FORMATS, export_rows, filter_orders
+from base.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Stream orders joined with items and shipping addresses to CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+        parser.add_argument('--from', dest='from', help='Created on or after (ISO date or datetime)')
+        parser.add_argument('--to', help='Created on or before (ISO date or datetime)')
+        parser.add_argument('--status', choices=[value for value, _ in Order.STATUS_CHOICES])
+        parser.add_argument('--is-paid', dest='isPaid', choices=['true', 'false'])
+        parser.add_argument('--is-delivered', dest='isDelivered', choices=['true', 'false'])
+        parser.add_argument('--user', help='Only orders of this user id')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            orders = filter_orders(Order.objects.all(), options)
+        except ValueError as e:
+            raise CommandError(str(e))
+        lines, _ = FORMATS[options['format']]
+        rows = export_rows(orders, chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+                out.writelines(lines(rows))
+        else:
+            for line in lines(rows):
+                self.stdout.write(line, ending='')
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from base.rollups import rebuild_order_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily order rollups used by the analytics endpoint from the order table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=0, help='Only rebuild the last N days (default: all)')
+
+    def handle(self, *args, **options):
+        since = timezone.localdate() - timedelta(days=options['days']) if options['days'] > 0 else None
+        written = rebuild_order_rollups(since=since)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} daily order rollups'))
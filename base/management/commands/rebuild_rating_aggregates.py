@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from base.cache import bump_catalog_version
+from base.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Recompute numReviews, rating and the star histogram for all products from their reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated = rebuild_rating_aggregates(batch_size=options['batch_size'])
+        # bulk_update does not send post_save, so drop cached catalog pages explicitly
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {updated} products'))
@@ -0,0 +1,61 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.utils.encoding import filepath_to_uri
+
+
+@lru_cache(maxsize=1)
+def _storage_base():
+    """Public URL prefix for stored files, worked out from settings once.
+    Returns None when URLs cannot be precomputed (e.g. signed S3 URLs)."""
+    storage = settings.STORAGES.get('default', {})
+    backend = storage.get('BACKEND', '')
+    options = storage.get('OPTIONS', {})
+    if backend == 'django.core.files.storage.FileSystemStorage':
+        return options.get('base_url') or settings.MEDIA_URL
+    if backend == 'storages.backends.s3boto3.S3Boto3Storage':
+        domain = options.get('custom_domain', getattr(settings, 'AWS_S3_CUSTOM_DOMAIN', None))
+        signed = options.get('querystring_auth', getattr(settings, 'AWS_QUERYSTRING_AUTH', True))
+        if not domain or signed:
+            return None
+        protocol = getattr(settings, 'AWS_S3_URL_PROTOCOL', 'https:')
+        location = options.get('location', '').strip('/')
+        return f"{protocol}//{domain}/" + (f"{location}/" if location else '')
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _resolve(base, name):
+    return base + filepath_to_uri(name.lstrip('/'))
+
+
+def _origin(request):
+    # build_absolute_uri is only needed once per request, not once per image
+    origin = getattr(request, '_media_origin', None)
+    if origin is None:
+        origin = request.build_absolute_uri('/')[:-1]
+        request._media_origin = origin
+    return origin
+
+
+def media_url(name, request=None):
+    """URL for a stored file name without instantiating storage per object.
+    Relative URLs are made absolute against request when one is given."""
+    if not name:
+        return None
+    base = _storage_base()
+    url = default_storage.url(name) if base is None else _resolve(base, name)
+    if request is not None and url.startswith('/'):
+        url = _origin(request) + url
+    return url
+
+
+def _clear(**kwargs):
+    if kwargs.get('setting') in ('STORAGES', 'MEDIA_URL', 'AWS_S3_CUSTOM_DOMAIN', 'AWS_QUERYSTRING_AUTH'):
+        _storage_base.cache_clear()
+        _resolve.cache_clear()
+
+
+setting_changed.connect(_clear)
@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.contrib.auth import middleware as auth
+from django.contrib.messages import middleware as messages
+from django.contrib.sessions import middleware as sessions
+from django.middleware import csrf
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+from whitenoise import middleware as whitenoise
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+# The JSON API authenticates with JWT bearer tokens and never touches
+# sessions, messages, CSRF cookies or static files, so these middleware
+# pass API_PREFIX requests straight through. They stay in their usual slots
+# in MIDDLEWARE (and remain subclasses of the stock classes, which the admin
+# system checks look for), so /admin/ and everything else is unchanged.
+
+
+def is_api(request):
+    return request.path_info.startswith(getattr(settings, 'API_PREFIX', '/api/'))
+
+
+class APIBypassMixin:
+    def __call__(self, request):
+        if is_api(request):
+            # Sync or async, whichever mode the chain was built in
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class WhiteNoiseMiddleware(APIBypassMixin, whitenoise.WhiteNoiseMiddleware):
+    pass
+
+
+class SessionMiddleware(APIBypassMixin, sessions.SessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(APIBypassMixin, csrf.CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        # Registered separately from __call__ by the handler
+        if is_api(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class AuthenticationMiddleware(APIBypassMixin, auth.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(APIBypassMixin, messages.MessageMiddleware):
+    pass
+
+# Only text formats are worth compressing; images and files are already packed
+COMPRESSIBLE_TYPES = ('application/json', 'text/csv', 'application/x-ndjson', 'text/html', 'text/plain')
+
+
+def accepted_encodings(header):
+    """{coding: q} from an Accept-Encoding header."""
+    codings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            codings[coding.strip().lower()] = q
+    return codings
+
+
+def negotiate_encoding(header):
+    """br when brotli is installed and the client prefers it at least as much
+    as gzip, else gzip, else None."""
+    codings = accepted_encodings(header)
+    wildcard = codings.get('*', 0.0)
+    br = codings.get('br', wildcard) if brotli else 0.0
+    gzip = codings.get('gzip', wildcard)
+    if br > 0 and br >= gzip:
+        return 'br'
+    if gzip > 0:
+        return 'gzip'
+    return None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compresses API responses of at least COMPRESSION_MIN_SIZE bytes with
+    brotli or gzip, whichever Accept-Encoding prefers. Streaming responses
+    (exports, the order event stream) are left alone so rows and events
+    reach the client as they are produced; the admin and static files keep
+    their own handling."""
+
+    # Same BREACH mitigation as django.middleware.gzip.GZipMiddleware
+    max_random_bytes = 100
+
+    def process_response(self, request, response):
+        if not is_api(request) or response.streaming or response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in COMPRESSIBLE_TYPES:
+            return response
+        if len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 1024):
+            return response
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli.compress(response.content, quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5))
+        else:
+            compressed = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The body changed, so a strong validator no longer matches it byte for byte
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 00:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_productmedialink'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='refundTotal',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='refundedAt',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
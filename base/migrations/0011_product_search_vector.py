@@ -0,0 +1,52 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE base_product SET search_vector = "
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS base_product_search_gin ON base_product USING gin (search_vector)"
+        )
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS base_product_fts "
+                "USING fts5(name, description, tokenize = 'porter unicode61')"
+            )
+        except Exception:
+            # SQLite built without FTS5: search falls back to icontains
+            return
+        schema_editor.execute(
+            "INSERT INTO base_product_fts (rowid, name, description) "
+            "SELECT _id, coalesce(name, ''), coalesce(description, '') FROM base_product"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS base_product_search_gin")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS base_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_order_refundtotal_order_refundedat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.3 on 2026-10-18 00:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def dedupe_reviews(apps, schema_editor):
+    # The old exists() check could race, so keep the newest review per
+    # (product, user) before adding the constraint and recount those products
+    Product = apps.get_model('base', 'Product')
+    Review = apps.get_model('base', 'Review')
+    dupes = Review.objects.filter(product__isnull=False, user__isnull=False).values('product', 'user').annotate(
+        n=models.Count('pk'), keep=models.Max('pk')).filter(n__gt=1)
+    affected = set()
+    for row in dupes:
+        Review.objects.filter(product=row['product'], user=row['user']).exclude(pk=row['keep']).delete()
+        affected.add(row['product'])
+    for pk in affected:
+        stats = Review.objects.filter(product=pk).aggregate(num=models.Count('pk'), avg=models.Avg('rating'))
+        Product.objects.filter(pk=pk).update(numReviews=stats['num'], rating=round(stats['avg'] or 0, 2))
+
+
+def backfill_histogram(apps, schema_editor):
+    Product = apps.get_model('base', 'Product')
+    Review = apps.get_model('base', 'Review')
+    rows = Review.objects.filter(product__isnull=False, rating__in=[1, 2, 3, 4, 5]).values('product', 'rating').annotate(n=models.Count('pk'))
+    for row in rows:
+        Product.objects.filter(pk=row['product']).update(**{f"stars{row['rating']}": row['n']})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_product_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stars1',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars2',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars3',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars4',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars5',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(dedupe_reviews, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='review',
+            constraint=models.UniqueConstraint(fields=('product', 'user'), name='unique_review_per_user'),
+        ),
+        migrations.RunPython(backfill_histogram, migrations.RunPython.noop),
+    ]
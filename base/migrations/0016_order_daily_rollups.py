@@ -0,0 +1,48 @@
+# Generated by Django 5.1.3 on 2026-10-18 00:38
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    Order = apps.get_model('base', 'Order')
+    OrderDailyRollup = apps.get_model('base', 'OrderDailyRollup')
+
+    def money(field, **kwargs):
+        return Coalesce(Sum(field, **kwargs), Value(0), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+    days = Order.objects.annotate(day=TruncDate('createdAt')).values('day').annotate(
+        orderCount=Count('pk'),
+        sales=money('totalPrice'),
+        paidCount=Count('pk', filter=Q(isPaid=True)),
+        paidSales=money('totalPrice', filter=Q(isPaid=True)),
+        deliveredCount=Count('pk', filter=Q(isDelivered=True)),
+        refunds=money('refundTotal'),
+    )
+    OrderDailyRollup.objects.bulk_create([OrderDailyRollup(**row) for row in days], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('orderCount', models.IntegerField(default=0)),
+                ('sales', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('paidCount', models.IntegerField(default=0)),
+                ('paidSales', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('deliveredCount', models.IntegerField(default=0)),
+                ('refunds', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.3 on 2026-10-18 00:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_change_seq(apps, schema_editor):
+    Order = apps.get_model('base', 'Order')
+    ChangeSequence = apps.get_model('base', 'ChangeSequence')
+    seq = 0
+    batch = []
+    for order in Order.objects.only('_id', 'changeSeq').order_by('updatedAt', '_id').iterator(chunk_size=1000):
+        seq += 1
+        order.changeSeq = seq
+        batch.append(order)
+        if len(batch) >= 1000:
+            Order.objects.bulk_update(batch, ['changeSeq'])
+            batch = []
+    Order.objects.bulk_update(batch, ['changeSeq'])
+    ChangeSequence.objects.create(name='order', value=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0017_idempotency_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='changeSeq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['changeSeq'], name='order_change_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'changeSeq'], name='order_user_change_seq_idx'),
+        ),
+        migrations.RunPython(backfill_change_seq, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-18 00:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    Order = apps.get_model('base', 'Order')
+    Order.objects.filter(isPaid=True).update(status='paid')
+    Order.objects.filter(isDelivered=True).update(status='delivered')
+    Order.objects.filter(refundTotal__gt=0).update(status='refunded')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0018_order_change_feed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Awaiting payment'), ('paid', 'Awaiting fulfillment'), ('delivered', 'Delivered'), ('refunded', 'Refunded')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['createdAt', '_id'], name='order_awaiting_payment_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'paid')), fields=['createdAt', '_id'], name='order_awaiting_fulfil_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'refunded')), fields=['createdAt', '_id'], name='order_refunded_idx'),
+        ),
+    ]
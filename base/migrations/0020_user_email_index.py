@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# auth_user belongs to django.contrib.auth, so its case-insensitive lookup
+# indexes are created here. They match the SQL Django emits for __iexact and
+# __istartswith: UPPER(col::text) LIKE ... on PostgreSQL, LIKE on SQLite
+# (which is case-insensitive and can use a NOCASE index).
+COLUMNS = ('email', 'first_name')
+
+
+def create_user_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for column in COLUMNS:
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS auth_user_{column}_ci_idx "
+                f"ON auth_user (UPPER({column}::text) text_pattern_ops)"
+            )
+        elif vendor == 'sqlite':
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS auth_user_{column}_ci_idx ON auth_user ({column} COLLATE NOCASE)"
+            )
+
+
+def drop_user_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        for column in COLUMNS:
+            schema_editor.execute(f"DROP INDEX IF EXISTS auth_user_{column}_ci_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0019_order_status'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_user_indexes, drop_user_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0020_user_email_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='isBackordered',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-18 01:11
+
+import django.db.models.expressions
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0021_order_backordered'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_low_stock_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.expressions.CombinedExpression(models.F('countInStock'), '-', models.F('reservedStock')), models.F('_id'), name='product_available_idx'),
+        ),
+    ]
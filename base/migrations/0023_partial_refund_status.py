@@ -0,0 +1,22 @@
+from django.db import migrations
+from django.db.models import F, Q
+
+
+def restore_fulfillment_status(apps, schema_editor):
+    # 0019 marked every order with any refund as refunded; only full refunds are
+    Order = apps.get_model('base', 'Order')
+    partial = Order.objects.filter(status='refunded').filter(Q(totalPrice__isnull=True) | Q(refundTotal__lt=F('totalPrice')))
+    partial.filter(isDelivered=True).update(status='delivered')
+    partial.filter(isDelivered=False, isPaid=True).update(status='paid')
+    partial.filter(isDelivered=False, isPaid=False).update(status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0022_product_available_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(restore_fulfillment_status, migrations.RunPython.noop),
+    ]
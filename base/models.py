@@ -1,5 +1,7 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 
 
 # Create your models here.
@@ -11,11 +13,34 @@ class Product(models.Model):
     description =models.TextField( null=True, blank=True)
     rating = models.DecimalField(max_digits=7 , decimal_places=2, null = True, blank = True)
     numReviews = models.IntegerField(null = True, blank = True, default=0)
+    # Per-star review histogram, kept in step with numReviews/rating by createProductReview
+    stars1 = models.IntegerField(default=0)
+    stars2 = models.IntegerField(default=0)
+    stars3 = models.IntegerField(default=0)
+    stars4 = models.IntegerField(default=0)
+    stars5 = models.IntegerField(default=0)
     price = models.DecimalField(max_digits=7 , decimal_places=2, null = True, blank = True)
     countInStock = models.IntegerField(null = True, blank = True, default=0)
+    # Units held by unexpired checkout reservations; available = countInStock - reservedStock
+    reservedStock = models.IntegerField(default=0)
     createdAt = models.DateTimeField(auto_now_add=True)
+    # Also touched when reviews or linked media change (see base.signals)
+    updatedAt = models.DateTimeField(auto_now=True)
+    # Maintained by base.search on Postgres (weighted name > description, GIN indexed)
+    search_vector = SearchVectorField(null=True, editable=False)
     _id = models.AutoField(primary_key=True , editable=False)
 
+    class Meta:
+        indexes = [
+            # Catalog sorts (with the pk tiebreak used by cursor pagination)
+            models.Index(fields=['name', '_id'], name='product_name_idx'),
+            models.Index(fields=['price', '_id'], name='product_price_idx'),
+            models.Index(fields=['rating', '_id'], name='product_rating_idx'),
+            models.Index(fields=['updatedAt'], name='product_updated_idx'),
+            # Low-stock lookups rank products by available units (see reservations.with_available)
+            models.Index(models.F('countInStock') - models.F('reservedStock'), models.F('_id'), name='product_available_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
@@ -28,11 +53,22 @@ class Review(models.Model):
     comment = models.TextField( null=True, blank=True)
     _id = models.AutoField(primary_key=True , editable=False)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'user'], name='unique_review_per_user'),
+        ]
+
     def __str__(self):
         return str(self.rating)
 
 
 class Order(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Awaiting payment'),
+        ('paid', 'Awaiting fulfillment'),
+        ('delivered', 'Delivered'),
+        ('refunded', 'Refunded'),
+    )
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     paymentMethod = models.CharField(max_length=200, null=True, blank=True)
     taxPrice = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
@@ -44,10 +80,30 @@ class Order(models.Model):
     refundTotal = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
     refundedAt = models.DateTimeField(auto_now_add=False, null=True, blank=True)
     isDelivered = models.BooleanField(default=False)
+    # Paid after its stock holds lapsed and the units were sold elsewhere
+    isBackordered = models.BooleanField(default=False)
     deliveredAt = models.DateTimeField(auto_now_add=False, null=True, blank=True)
+    # Moved only by base.orderstate; isPaid/isDelivered are kept in step for clients
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     createdAt = models.DateTimeField(auto_now_add=True)  # Automatically sets timestamp on creation
+    updatedAt = models.DateTimeField(auto_now=True)
+    # Stamped from the 'order' ChangeSequence after every committed write; drives ?since= syncs
+    changeSeq = models.BigIntegerField(default=0)
     _id = models.AutoField(primary_key=True, editable=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['createdAt'], name='order_created_idx'),
+            models.Index(fields=['user', 'createdAt'], name='order_user_created_idx'),
+            models.Index(fields=['updatedAt'], name='order_updated_idx'),
+            models.Index(fields=['changeSeq'], name='order_change_seq_idx'),
+            models.Index(fields=['user', 'changeSeq'], name='order_user_change_seq_idx'),
+            # Work queues only index their own open orders, not the history
+            models.Index(fields=['createdAt', '_id'], name='order_awaiting_payment_idx', condition=models.Q(status='pending')),
+            models.Index(fields=['createdAt', '_id'], name='order_awaiting_fulfil_idx', condition=models.Q(status='paid')),
+            models.Index(fields=['createdAt', '_id'], name='order_refunded_idx', condition=models.Q(status='refunded')),
+        ]
+
     def __str__(self):
         return str(self.createdAt)
 
@@ -88,8 +144,10 @@ class ProductVariant(models.Model):
     price_cents = models.IntegerField(default=0)
     currency = models.CharField(max_length=3, default='USD')
     stock = models.IntegerField(default=0)
+    reserved = models.IntegerField(default=0)
     position = models.IntegerField(default=0)
     createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.product.name if self.product else 'Product'} – {self.sku or 'SKU'}"
@@ -105,6 +163,7 @@ class ProductMedia(models.Model):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='gallery')
     position = models.IntegerField(default=0)
     createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.alt or (self.file.name if self.file else 'Media')
@@ -118,6 +177,7 @@ class Collection(models.Model):
     hero_media = models.ForeignKey(ProductMedia, on_delete=models.SET_NULL, null=True, blank=True, related_name='hero_for_collections')
     published_at = models.DateTimeField(blank=True, null=True)
     createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title or self.slug
@@ -147,6 +207,82 @@ class ProductMediaLink(models.Model):
     class Meta:
         unique_together = ('product', 'media')
         ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['product', 'position', 'id'], name='media_link_position_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name if self.product else 'Product'} – {self.media_id}"
+
+
+class StockReservation(models.Model):
+    STATUS_CHOICES = (
+        ('held', 'Held'),
+        ('confirmed', 'Confirmed'),
+        ('released', 'Released'),
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, null=True, blank=True, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='reservations')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    qty = models.IntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='held')
+    expiresAt = models.DateTimeField()
+    createdAt = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The sweeper only ever looks at live holds
+            models.Index(fields=['expiresAt'], name='reservation_expiry_idx', condition=models.Q(status='held')),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} x{self.qty} ({self.status})"
+
+
+class OrderDailyRollup(models.Model):
+    # One row per order creation day, kept current by base.rollups
+    day = models.DateField(unique=True)
+    orderCount = models.IntegerField(default=0)
+    sales = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    paidCount = models.IntegerField(default=0)
+    paidSales = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    deliveredCount = models.IntegerField(default=0)
+    refunds = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.day)
+
+
+class IdempotencyKey(models.Model):
+    # First response for a client-supplied Idempotency-Key, replayed to retries
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    # Null until the first request finishes
+    responseStatus = models.IntegerField(null=True, blank=True)
+    responseBody = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    createdAt = models.DateTimeField(auto_now_add=True)
+    expiresAt = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['expiresAt'], name='idempotency_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.scope})"
+
+
+class ChangeSequence(models.Model):
+    # Named monotonic counters, bumped by base.changefeed.stamp_change
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
 
     def __str__(self):
-        return f"{self.product.name if self.product else 'Product'} – {self.media_id}"
\ No newline at end of file
+        return f"{self.name}={self.value}"
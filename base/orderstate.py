@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from base.changefeed import stamp_change
+from base.models import Order
+
+# action -> (states it may start from, state it ends in). A refund only ends
+# in 'refunded' once refundTotal covers totalPrice; partial refunds are
+# tracked in refundTotal and leave fulfillment status alone.
+TRANSITIONS = {
+    'pay': (('pending',), 'paid'),
+    'deliver': (('paid',), 'delivered'),
+    'refund': (('paid', 'delivered'), 'refunded'),
+}
+
+# Admin work queues: name -> (state, newest first?). Each is served by a
+# partial (createdAt, _id) index over just that state.
+QUEUES = {
+    'awaiting-payment': ('pending', False),
+    'awaiting-fulfillment': ('paid', False),
+    'refunded': ('refunded', True),
+}
+
+
+class InvalidTransition(Exception):
+    def __init__(self, status, action):
+        super().__init__(f'Cannot {action} an order that is {status}')
+        self.status = status
+        self.action = action
+
+
+class RefundExceedsTotal(Exception):
+    def __init__(self):
+        super().__init__('Refund exceeds the amount paid for the order')
+
+
+def transition(order_id, action, *conditions, **changes):
+    """Move an order with one conditional UPDATE that only matches while it
+    is in an allowed source state (and meets any extra Q conditions), so
+    concurrent requests cannot both apply the same transition. Returns the
+    updated order; raises Order.DoesNotExist or InvalidTransition."""
+    sources, target = TRANSITIONS[action]
+    changes.setdefault('status', target)
+    # .update() skips the save signals, so stamp updatedAt and the change feed here
+    updated = Order.objects.filter(*conditions, _id=order_id, status__in=sources).update(
+        updatedAt=timezone.now(), **changes)
+    if not updated:
+        current = Order.objects.filter(_id=order_id).values_list('status', flat=True).first()
+        if current is None:
+            raise Order.DoesNotExist
+        raise InvalidTransition(current, action)
+    order = Order.objects.get(_id=order_id)
+    stamp_change(order)
+    return order
+
+
+def pay(order_id):
+    return transition(order_id, 'pay', isPaid=True, paidAt=timezone.now())
+
+
+def deliver(order_id):
+    return transition(order_id, 'deliver', isDelivered=True, deliveredAt=timezone.now())
+
+
+def refund(order_id, amount):
+    total = Coalesce(F('refundTotal'), Value(Decimal('0')), output_field=DecimalField(max_digits=7, decimal_places=2))
+    refunded = total + Decimal(str(amount))
+    fully = Case(When(totalPrice__lte=refunded, then=Value('refunded')), default=F('status'))
+    try:
+        # Checked in the same UPDATE, so concurrent refunds cannot overshoot together
+        return transition(order_id, 'refund', Q(totalPrice__gte=refunded),
+                          refundTotal=refunded, refundedAt=timezone.now(), status=fully)
+    except InvalidTransition as e:
+        if e.status in TRANSITIONS['refund'][0]:
+            raise RefundExceedsTotal()
+        raise
+
+
+def queue(name):
+    state, newest_first = QUEUES[name]
+    return Order.objects.filter(status=state), newest_first
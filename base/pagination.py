@@ -0,0 +1,147 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Q
+
+# Opt-in keyset pagination. A cursor records the sort key and primary key of
+# the row at a page boundary, so each page is an indexed seek instead of an
+# OFFSET scan, and no COUNT(*) is needed unless the client asks for one.
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder drops microseconds past milliseconds, which would make
+    # the boundary row compare greater than its own cursor
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(state):
+    raw = json.dumps(state, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(state, dict) or not {'s', 'd', 'v', 'pk'} <= state.keys():
+            raise ValueError
+        return state
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def _sort_column(queryset, sort_by):
+    """(column, output field, nullable) for a model field or annotation."""
+    if sort_by in queryset.query.annotations:
+        return sort_by, queryset.query.annotations[sort_by].output_field, False
+    try:
+        field = queryset.model._meta.get_field(sort_by)
+    except FieldDoesNotExist:
+        raise InvalidCursor(f'Cannot paginate on {sort_by}')
+    if field.is_relation and not field.concrete:
+        raise InvalidCursor(f'Cannot paginate on {sort_by}')
+    return field.attname, field, field.null
+
+
+def _cursor_value(field, value):
+    if value is None:
+        return None
+    try:
+        return field.to_python(value)
+    except (ValidationError, TypeError, ValueError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def _nulls_high():
+    # Rows are ordered the way the (column, pk) indexes store them so the
+    # ORDER BY is an index walk: NULLs sort above every value on Postgres and
+    # below every value on SQLite
+    return connection.vendor == 'postgresql'
+
+
+def _after(column, nullable, op, value, pk_name, pk, nulls_after):
+    """Rows strictly after (value, pk) in the scan order."""
+    if value is None:
+        after = Q(**{f'{column}__isnull': True, f'{pk_name}__{op}': pk})
+        return after if nulls_after else after | Q(**{f'{column}__isnull': False})
+    after = Q(**{f'{column}__{op}': value}) | Q(**{column: value, f'{pk_name}__{op}': pk})
+    if nullable and nulls_after:
+        after |= Q(**{f'{column}__isnull': True})
+    return after
+
+
+def keyset_page(queryset, sort_by, descending, page_size, cursor=''):
+    """Return (rows, next_cursor, prev_cursor) for the page after/before cursor.
+    Rows are ordered on (sort_by, pk) in the requested direction; NULL sort
+    values come in the database's native position (see _nulls_high)."""
+    pk_field = queryset.model._meta.pk
+    pk_name = pk_field.attname
+    column, field, nullable = _sort_column(queryset, sort_by)
+    spec = f"{'-' if descending else ''}{sort_by}"
+    state = decode_cursor(cursor) if cursor else None
+    if state and state['s'] != spec:
+        raise InvalidCursor('Cursor does not match the requested sort')
+
+    backwards = bool(state) and state['d'] == 'p'
+    scan_desc = descending != backwards
+    qs = queryset
+    if state:
+        value = _cursor_value(field, state['v'])
+        pk = _cursor_value(pk_field, state['pk'])
+        if pk is None or (value is None and not nullable):
+            raise InvalidCursor('Invalid cursor')
+        op = 'lt' if scan_desc else 'gt'
+        qs = qs.filter(_after(column, nullable, op, value, pk_name, pk, _nulls_high() != scan_desc))
+    prefix = '-' if scan_desc else ''
+    rows = list(qs.order_by(f'{prefix}{column}', f'{prefix}{pk_name}')[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    def boundary(row, direction):
+        return encode_cursor({'s': spec, 'd': direction, 'v': getattr(row, column), 'pk': getattr(row, pk_name)})
+
+    if not rows:
+        return rows, None, None
+    if backwards:
+        return rows, boundary(rows[-1], 'n'), boundary(rows[0], 'p') if has_more else None
+    return rows, boundary(rows[-1], 'n') if has_more else None, boundary(rows[0], 'p') if state else None
+
+
+def estimate_count(queryset):
+    """Planner row estimate on Postgres (no table scan), exact count elsewhere."""
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def paginate_cursor(request, queryset, sort_by, descending, page_size):
+    """Cursor mode for list views: returns (rows, meta). ?count=exact|estimate
+    adds a total to meta; by default no count query is issued."""
+    cursor = request.query_params.get('cursor', '')
+    rows, next_cursor, prev_cursor = keyset_page(queryset, sort_by, descending, page_size, cursor)
+    meta = {'next': next_cursor, 'prev': prev_cursor}
+    count_mode = request.query_params.get('count')
+    if count_mode == 'exact':
+        meta['count'] = queryset.count()
+    elif count_mode == 'estimate':
+        meta['count'] = estimate_count(queryset)
+    return rows, meta
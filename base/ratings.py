@@ -0,0 +1,55 @@
+from django.db.models import Avg, Count, F, FloatField, Q, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from base.models import Product, Review
+
+STARS = (1, 2, 3, 4, 5)
+
+
+def _star_total():
+    return sum((F(f'stars{n}') * n for n in STARS[1:]), F('stars1'))
+
+
+def record_review(product_id, rating):
+    """Fold one new review into the product's aggregates with a single UPDATE.
+    All right-hand sides read the pre-update row, so concurrent reviewers
+    cannot overwrite each other's counts."""
+    num = Coalesce(F('numReviews'), Value(0))
+    return Product.objects.filter(_id=product_id).update(
+        numReviews=num + 1,
+        rating=Cast(_star_total() + rating, FloatField()) / (num + 1),
+        **{f'stars{rating}': F(f'stars{rating}') + 1},
+        updatedAt=timezone.now(),
+    )
+
+
+def rebuild_rating_aggregates(batch_size=500):
+    """Recompute numReviews, rating and the star histogram for every product
+    from the review table. Returns the number of products updated."""
+    fields = ['numReviews', 'rating', 'updatedAt'] + [f'stars{n}' for n in STARS]
+    now = timezone.now()
+    stats = {
+        row['product']: row
+        for row in Review.objects.filter(product__isnull=False).values('product').annotate(
+            num=Count('pk'),
+            avg=Avg('rating'),
+            **{f's{n}': Count('pk', filter=Q(rating=n)) for n in STARS},
+        )
+    }
+    updated = 0
+    batch = []
+    for product in Product.objects.only('_id', *fields).iterator(chunk_size=batch_size):
+        row = stats.get(product._id)
+        product.numReviews = row['num'] if row else 0
+        product.updatedAt = now
+        product.rating = round(row['avg'], 2) if row else 0
+        for n in STARS:
+            setattr(product, f'stars{n}', row[f's{n}'] if row else 0)
+        batch.append(product)
+        if len(batch) >= batch_size:
+            updated += Product.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        updated += Product.objects.bulk_update(batch, fields)
+    return updated
@@ -0,0 +1,34 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to DRF's encoder
+    orjson = None
+
+# Datetimes come out as ISO 8601 with a Z suffix for UTC, like the
+# serializer DateTimeFields; dicts keyed by ints (rollup buckets) are allowed
+OPTIONS = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+# The rest (Decimal, lazy strings, timedelta, querysets...) is encoded the way
+# DRF's JSONEncoder does it, so output matches the stock renderer
+_default = encoders.JSONEncoder().default
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer backed by orjson, which encodes dicts, lists, str, ints,
+    floats, datetimes, dates, times and UUIDs in C. Anything the stock
+    renderer would format differently (?indent=, UNICODE_JSON/COMPACT_JSON
+    turned off) or an environment without orjson uses JSONRenderer itself."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type or '', renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=_default, option=OPTIONS)
+        # Same escaping as JSONRenderer so the output is safe inside <script>
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
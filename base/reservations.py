@@ -0,0 +1,162 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from base.cache import bump_catalog_version, get_cache
+from base.models import Order, Product, ProductVariant, StockReservation
+
+# Checkout places time-limited holds instead of decrementing stock. A hold moves
+# units into reservedStock / reserved; paying confirms it (stock and reserved both
+# drop), and the sweeper hands expired holds back. Available-to-sell is always
+# countInStock - reservedStock, so it never needs to look at order history.
+# Holds only move reservedStock, which cached catalog pages leave out (clients
+# read live availability from getAvailability); confirming lowers countInStock,
+# which they do show, so it bumps the catalog version once committed.
+SWEEP_KEY = 'reservations:sweep'
+
+
+class OutOfStock(Exception):
+    pass
+
+
+def hold_ttl():
+    return timedelta(minutes=getattr(settings, 'STOCK_HOLD_TTL_MINUTES', 15))
+
+
+def _take(model, pk, qty, stock_field, reserved_field, now):
+    # Conditional increment: only succeeds while enough unreserved stock remains
+    return model.objects.filter(
+        pk=pk, **{f'{stock_field}__gte': F(reserved_field) + qty}
+    ).update(**{reserved_field: F(reserved_field) + qty}, updatedAt=now)
+
+
+def _give_back(model, pk, qty, reserved_field, now):
+    return model.objects.filter(pk=pk).update(**{reserved_field: F(reserved_field) - qty}, updatedAt=now)
+
+
+def hold_stock(lines, user=None, order=None, ttl=None):
+    """Reserve stock for lines of (product, variant or None, qty). Raises
+    OutOfStock naming the first product that cannot be held; call inside a
+    transaction so a failure releases the earlier lines too."""
+    now = timezone.now()
+    expires = now + (ttl or hold_ttl())
+    totals = {}
+    for product, variant, qty in lines:
+        key = (product._id, variant.pk if variant else None)
+        totals[key] = (product, variant, totals.get(key, (None, None, 0))[2] + qty)
+
+    reservations = []
+    # Sorted keys keep row-lock order consistent between concurrent checkouts
+    for key in sorted(totals, key=lambda k: (k[0], k[1] or 0)):
+        product, variant, qty = totals[key]
+        if not _take(Product, product._id, qty, 'countInStock', 'reservedStock', now):
+            raise OutOfStock(product.name)
+        if variant and not _take(ProductVariant, variant.pk, qty, 'stock', 'reserved', now):
+            raise OutOfStock(str(variant))
+        reservations.append(StockReservation(
+            product=product, variant=variant, order=order, user=user, qty=qty, expiresAt=expires,
+        ))
+    StockReservation.objects.bulk_create(reservations)
+    return reservations
+
+
+def _retake(r, now):
+    """Hold a released reservation's units again; False (and nothing held)
+    when they have been sold or held by someone else since."""
+    if not _take(Product, r.product_id, r.qty, 'countInStock', 'reservedStock', now):
+        return False
+    if r.variant_id and not _take(ProductVariant, r.variant_id, r.qty, 'stock', 'reserved', now):
+        _give_back(Product, r.product_id, r.qty, 'reservedStock', now)
+        return False
+    return True
+
+
+def confirm_order(order):
+    """Turn an order's holds into sold stock. Payment has already been
+    captured, so this never fails: holds the sweeper released are taken again
+    if stock allows, and otherwise the units are sold short (stock goes
+    negative) and the order is flagged isBackordered. Returns True if it was."""
+    now = timezone.now()
+    short = False
+    with transaction.atomic():
+        for r in StockReservation.objects.filter(order=order).exclude(status='confirmed').order_by('product_id', 'pk'):
+            was_held = StockReservation.objects.filter(pk=r.pk, status='held').update(status='confirmed')
+            held = was_held or _retake(r, now)
+            if not was_held:
+                StockReservation.objects.filter(pk=r.pk).update(status='confirmed')
+            short = short or not held
+            reserved = {'reservedStock': F('reservedStock') - r.qty} if held else {}
+            Product.objects.filter(_id=r.product_id).update(
+                countInStock=F('countInStock') - r.qty, updatedAt=now, **reserved,
+            )
+            if r.variant_id:
+                reserved = {'reserved': F('reserved') - r.qty} if held else {}
+                ProductVariant.objects.filter(pk=r.variant_id).update(
+                    stock=F('stock') - r.qty, updatedAt=now, **reserved,
+                )
+        if short:
+            Order.objects.filter(pk=order.pk).update(isBackordered=True)
+            order.isBackordered = True
+        transaction.on_commit(bump_catalog_version)
+    return short
+
+
+def release_expired(now=None, batch_size=1000):
+    """Release every expired hold in bulk; returns the number released."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(status='held', expiresAt__lte=now)
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            StockReservation.objects.filter(pk__in=ids).update(status='released')
+            rows = StockReservation.objects.filter(pk__in=ids)
+            for row in rows.values('product_id').annotate(qty=Sum('qty')):
+                _give_back(Product, row['product_id'], row['qty'], 'reservedStock', now)
+            for row in rows.filter(variant__isnull=False).values('variant_id').annotate(qty=Sum('qty')):
+                _give_back(ProductVariant, row['variant_id'], row['qty'], 'reserved', now)
+            released += len(ids)
+        if len(ids) < batch_size:
+            break
+    return released
+
+
+def sweep_expired():
+    """release_expired() at most once per STOCK_SWEEP_INTERVAL_SECONDS, for
+    the request paths that read or take stock, so lapsed holds are handed
+    back without a separate scheduler. release_expired_holds can still run
+    from cron as well."""
+    if get_cache().add(SWEEP_KEY, True, getattr(settings, 'STOCK_SWEEP_INTERVAL_SECONDS', 60)):
+        return release_expired()
+    return 0
+
+
+def with_available(queryset):
+    """Products annotated with `available` (unheld units), matching the
+    product_available_idx expression index."""
+    return queryset.annotate(available=F('countInStock') - F('reservedStock'))
+
+
+def available_to_sell(product_ids):
+    """Available units per product and variant, read from the counters."""
+    products = Product.objects.filter(_id__in=product_ids).only('_id', 'countInStock', 'reservedStock')
+    variants = ProductVariant.objects.filter(product_id__in=product_ids).only('id', 'product_id', 'stock', 'reserved')
+    by_product = {}
+    for v in variants:
+        by_product.setdefault(v.product_id, []).append({'id': v.id, 'available': max(v.stock - v.reserved, 0)})
+    return [
+        {
+            '_id': p._id,
+            'available': max((p.countInStock or 0) - p.reservedStock, 0),
+            'variants': by_product.get(p._id, []),
+        }
+        for p in products
+    ]
@@ -0,0 +1,132 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from base.models import Order, OrderDailyRollup
+
+BUCKETS = {'day': None, 'week': TruncWeek, 'month': TruncMonth}
+FIELDS = ['orderCount', 'sales', 'paidCount', 'paidSales', 'deliveredCount', 'refunds']
+ZERO = Decimal('0.00')
+
+
+def _money(field, **kwargs):
+    return Coalesce(Sum(field, **kwargs), Value(ZERO), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def _order_totals():
+    # Every metric is keyed by the day the order was placed
+    paid = Q(isPaid=True)
+    return {
+        'orderCount': Count('pk'),
+        'sales': _money('totalPrice'),
+        'paidCount': Count('pk', filter=paid),
+        'paidSales': _money('totalPrice', filter=paid),
+        'deliveredCount': Count('pk', filter=Q(isDelivered=True)),
+        'refunds': _money('refundTotal'),
+    }
+
+
+def _amount(value):
+    return Decimal(str(value or 0))
+
+
+def _bump(order, **deltas):
+    """Add deltas to the rollup row for the order's day with a single UPDATE."""
+    day = timezone.localdate(order.createdAt)
+    changes = {f: F(f) + v for f, v in deltas.items()}
+    if not OrderDailyRollup.objects.filter(day=day).update(**changes):
+        # First order of the day; get_or_create tolerates a concurrent insert
+        OrderDailyRollup.objects.get_or_create(day=day)
+        OrderDailyRollup.objects.filter(day=day).update(**changes)
+
+
+def record_order(order):
+    _bump(order, orderCount=1, sales=_amount(order.totalPrice))
+
+
+def record_paid(order):
+    _bump(order, paidCount=1, paidSales=_amount(order.totalPrice))
+
+
+def record_delivered(order):
+    _bump(order, deliveredCount=1)
+
+
+def record_refund(order, amount):
+    _bump(order, refunds=_amount(amount))
+
+
+def rebuild_order_rollups(since=None):
+    """Recompute rollup rows from the order table, from `since` (a date)
+    onwards or for all time. Returns the number of rows written."""
+    orders = Order.objects.all()
+    rollups = OrderDailyRollup.objects.all()
+    if since is not None:
+        orders = orders.filter(createdAt__gte=_start_of(since))
+        rollups = rollups.filter(day__gte=since)
+    days = orders.annotate(day=TruncDate('createdAt')).values('day').annotate(**_order_totals())
+    with transaction.atomic():
+        rollups.delete()
+        created = OrderDailyRollup.objects.bulk_create(
+            [OrderDailyRollup(**row) for row in days], batch_size=500)
+    return len(created)
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _period(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def order_series(days, bucket='day'):
+    """Time-bucketed order metrics for the last `days` days, oldest first.
+    Closed days come from the rollup table and only today is aggregated
+    from orders, so the cost follows the bucket count, not the order count."""
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    rows = OrderDailyRollup.objects.filter(day__gte=start, day__lt=today)
+    trunc = BUCKETS[bucket]
+    if trunc is None:
+        rows = rows.values(*FIELDS, period=F('day'))
+    else:
+        rows = rows.annotate(period=trunc('day')).values('period').annotate(**{f: Sum(f) for f in FIELDS})
+    series = {row['period']: row for row in rows.order_by('period')}
+
+    live = Order.objects.filter(createdAt__gte=_start_of(today)).aggregate(**_order_totals())
+    if live['orderCount']:
+        period = _period(today, bucket)
+        row = series.setdefault(period, {'period': period, **{f: 0 for f in FIELDS}})
+        for f in FIELDS:
+            row[f] += live[f]
+
+    for row in series.values():
+        row['netRevenue'] = row['paidSales'] - row['refunds']
+    return list(series.values())
+
+
+def range_totals(ranges):
+    """Totals for trailing windows given as {name: days}, in two queries:
+    one conditional aggregate over the rollups and one live aggregate for today."""
+    today = timezone.localdate()
+    closed = OrderDailyRollup.objects.filter(day__lt=today).aggregate(**{
+        f'{f}_{name}': Sum(f, filter=Q(day__gte=today - timedelta(days=days - 1)))
+        for name, days in ranges.items() for f in FIELDS
+    })
+    live = Order.objects.filter(createdAt__gte=_start_of(today)).aggregate(**_order_totals())
+    totals = {}
+    for name in ranges:
+        row = {f: (closed[f'{f}_{name}'] or 0) + live[f] for f in FIELDS}
+        row['netRevenue'] = row['paidSales'] - row['refunds']
+        row['averageOrderValue'] = round(row['sales'] / row['orderCount'], 2) if row['orderCount'] else 0
+        totals[name] = row
+    return totals
@@ -0,0 +1,93 @@
+import logging
+import re
+
+from django.db import connection
+from django.db.models import F, FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+logger = logging.getLogger(__name__)
+
+# Product search runs on a Postgres tsvector (GIN indexed) in production and on
+# an FTS5 virtual table under SQLite. Name matches outrank description matches.
+FTS_TABLE = 'base_product_fts'
+PG_CONFIG = 'english'
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_TERMS = 8
+
+
+def _terms(keyword):
+    return re.findall(r'\w+', (keyword or '').lower())[:MAX_TERMS]
+
+
+_fts_ready = False
+
+
+def _sqlite_fts_available():
+    global _fts_ready
+    if not _fts_ready:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts_ready = cursor.fetchone() is not None
+    return _fts_ready
+
+
+def search_products(queryset, keyword):
+    """Filter queryset to products matching keyword and annotate `search_rank`
+    (higher is more relevant). Every term is prefix-matched, all must match."""
+    terms = _terms(keyword)
+    if not terms:
+        if keyword:
+            queryset = queryset.filter(name__icontains=keyword)
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        query = SearchQuery(' & '.join(f'{t}:*' for t in terms), search_type='raw', config=PG_CONFIG)
+        # ts_rank is a float4; as a double it round-trips through a JSON cursor
+        # and compares equal to itself, so ties at a page boundary aren't lost
+        rank = Cast(SearchRank(F('search_vector'), query), FloatField())
+        return queryset.filter(search_vector=query).annotate(search_rank=rank)
+
+    if vendor == 'sqlite' and _sqlite_fts_available():
+        match = ' '.join(f'"{t}"*' for t in terms)
+        # Drive the query from the FTS index so only matching rows are ranked
+        matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+        # bm25() is negative with better matches lower, so flip the sign
+        rank = RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, %s, %s) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = base_product._id',
+            (NAME_WEIGHT, DESCRIPTION_WEIGHT, match),
+            output_field=FloatField(),
+        )
+        return queryset.filter(_id__in=matches).annotate(search_rank=rank)
+
+    return queryset.filter(name__icontains=keyword).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def index_product(product):
+    """Refresh the search index entry for a single product."""
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchVector
+
+        type(product).objects.filter(pk=product.pk).update(
+            search_vector=SearchVector('name', weight='A', config=PG_CONFIG)
+            + SearchVector('description', weight='B', config=PG_CONFIG)
+        )
+    elif vendor == 'sqlite' and _sqlite_fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.pk, product.name or '', product.description or ''],
+            )
+
+
+def unindex_product(pk):
+    if connection.vendor == 'sqlite' and _sqlite_fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
@@ -1,8 +1,68 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db.models import Count, DecimalField, Prefetch, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from rest_framework_simplejwt.tokens import RefreshToken
+from .media_urls import media_url
 from .models import Product, Order, OrderItem, ShippingAddress, Review, ProductVariant, ProductMedia, Collection, CollectionEntry, ProductMediaLink
 
+def _param_set(request, name):
+    raw = request.query_params.get(name, '') if request is not None else ''
+    return {f.strip() for f in raw.split(',') if f.strip()}
+
+
+class SparseFieldsMixin:
+    """?fields=a,b limits the output to the named fields. Embedded relations
+    (Meta.expand_select / Meta.expand_prefetch) are then only included when
+    named in ?expand=. Meta.sources maps computed fields to the model columns
+    they read, so setup_eager_loading can project with .only()."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.selected_fields(self.context.get('request'))
+        if selected is not None:
+            for name in set(self.fields) - selected:
+                self.fields.pop(name)
+
+    @classmethod
+    def expandable(cls):
+        return {**getattr(cls.Meta, 'expand_select', {}), **getattr(cls.Meta, 'expand_prefetch', {})}
+
+    @classmethod
+    def selected_fields(cls, request):
+        fields = _param_set(request, 'fields')
+        if not fields:
+            return None
+        return (fields - set(cls.expandable())) | (_param_set(request, 'expand') & set(cls.expandable()))
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, request=None):
+        selected = cls.selected_fields(request)
+        select = [v for k, v in getattr(cls.Meta, 'expand_select', {}).items() if selected is None or k in selected]
+        prefetch = [v for k, v in getattr(cls.Meta, 'expand_prefetch', {}).items() if selected is None or k in selected]
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if selected is not None:
+            model = cls.Meta.model
+            names = {f.name for f in model._meta.concrete_fields}
+            sources = getattr(cls.Meta, 'sources', {})
+            columns = {model._meta.pk.name}
+            for name in selected:
+                if name in names:
+                    columns.add(name)
+                columns.update(sources.get(name, ()))
+            # select_related paths must not be deferred, so load them whole
+            for path in select:
+                related = model._meta.get_field(path).related_model
+                columns.update(f'{path}__{f.name}' for f in related._meta.concrete_fields)
+            queryset = queryset.only(*columns)
+        return queryset
+
+
 class UserSerializer(serializers.ModelSerializer):
     name = serializers.SerializerMethodField(read_only=True)
     _id = serializers.SerializerMethodField(read_only=True)
@@ -35,47 +95,86 @@ class UserSerializerWithToken(UserSerializer):
         token = RefreshToken.for_user(obj)
         return str(token.access_token)
 
+class UserDirectorySerializer(UserSerializer):
+    """Admin user list rows; orderCount and lifetimeSpend come from annotations."""
+    orderCount = serializers.IntegerField(read_only=True)
+    lifetimeSpend = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    dateJoined = serializers.DateTimeField(source='date_joined', read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', '_id', 'username', 'email', 'name', 'isAdmin', 'dateJoined', 'orderCount', 'lifetimeSpend']
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, request=None):
+        paid = Q(order__isPaid=True)
+        return queryset.only('id', 'username', 'email', 'first_name', 'is_staff', 'date_joined').annotate(
+            orderCount=Count('order'),
+            lifetimeSpend=Coalesce(Sum('order__totalPrice', filter=paid), Value(Decimal('0')),
+                                   output_field=DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = '__all__'
 
-class ProductSerializer(serializers.ModelSerializer):
+# Products embed only their newest reviews; the rest are paged from /api/products/<pk>/reviews/
+LATEST_REVIEWS = 5
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     reviews = serializers.SerializerMethodField(read_only=True)
+    reviewSummary = serializers.SerializerMethodField(read_only=True)
     image_url = serializers.SerializerMethodField(read_only=True)
     media = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Product
-        fields = '__all__'
+        # reservedStock moves on every checkout; live stock comes from getAvailability
+        exclude = ['search_vector', 'reservedStock', 'stars1', 'stars2', 'stars3', 'stars4', 'stars5']
         extra_kwargs = {
             'rating': {'required': False} 
         }
+        # Reviews and media links are read for every product row; fetch them in bulk
+        expand_prefetch = {
+            'reviews': Prefetch('review_set', queryset=Review.objects.order_by('-_id')[:LATEST_REVIEWS], to_attr='latest_reviews'),
+            'media': Prefetch('media_links', queryset=ProductMediaLink.objects.select_related('media').order_by('position', 'id')),
+        }
+        sources = {
+            'image_url': ['image'],
+            'reviewSummary': ['numReviews', 'rating', 'stars1', 'stars2', 'stars3', 'stars4', 'stars5'],
+        }
 
     def get_reviews(self, obj):
-        reviews = obj.review_set.all()
+        reviews = getattr(obj, 'latest_reviews', None)
+        if reviews is None:
+            reviews = obj.review_set.order_by('-_id')[:LATEST_REVIEWS]
         serializer = ReviewSerializer(reviews, many=True)
         return serializer.data
 
+    def get_reviewSummary(self, obj):
+        # Maintained incrementally by base.ratings, so this never touches the review table
+        return {
+            'count': obj.numReviews or 0,
+            'average': obj.rating,
+            'histogram': {str(n): getattr(obj, f'stars{n}') for n in (1, 2, 3, 4, 5)},
+        }
+
     def get_image_url(self, obj):
-        request = self.context.get('request')
-        if obj.image and hasattr(obj.image, 'url'):
-            return request.build_absolute_uri(obj.image.url)
-        else:
-            return None
+        return media_url(obj.image.name, self.context.get('request'))
 
     def get_media(self, obj):
         # Include linked media for product detail/cards
         request = self.context.get('request')
-        links = ProductMediaLink.objects.filter(product=obj).select_related('media').order_by('position', 'id')
+        links = obj.media_links.all()
         result = []
         for link in links:
             m = link.media
             if not m:
                 continue
-            url = None
-            if m.file and hasattr(m.file, 'url') and request:
-                url = request.build_absolute_uri(m.file.url)
+            url = media_url(m.file.name, request) if request else None
             result.append({
                 'id': m.id,
                 'alt': m.alt,
@@ -97,7 +196,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = '__all__'
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     orderItems = serializers.SerializerMethodField(read_only=True)
     shippingAddress = serializers.SerializerMethodField(read_only=True)
     user = serializers.SerializerMethodField(read_only=True)
@@ -105,6 +204,8 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = '__all__'
+        expand_select = {'user': 'user', 'shippingAddress': 'shippingaddress'}
+        expand_prefetch = {'orderItems': 'orderitem_set'}
 
     def get_orderItems(self, obj):
         items = obj.orderitem_set.all()
@@ -124,6 +225,24 @@ class OrderSerializer(serializers.ModelSerializer):
             return None
 
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """Row shape for admin order tables: no items, address or nested user."""
+    userName = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['_id', 'status', 'createdAt', 'updatedAt', 'totalPrice', 'isPaid', 'paidAt', 'isDelivered', 'deliveredAt', 'refundTotal', 'user', 'userName']
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, request=None):
+        return queryset.select_related('user').only(*cls.Meta.fields[:-1], 'user__first_name', 'user__email')
+
+    def get_userName(self, obj):
+        if obj.user is None:
+            return None
+        return obj.user.first_name or obj.user.email
+
+
 # Catalog admin serializers
 class ProductVariantSerializer(serializers.ModelSerializer):
     class Meta:
@@ -141,9 +260,7 @@ class ProductMediaSerializer(serializers.ModelSerializer):
 
     def get_file_url(self, obj):
         request = self.context.get('request')
-        if obj.file and hasattr(obj.file, 'url') and request:
-            return request.build_absolute_uri(obj.file.url)
-        return None
+        return media_url(obj.file.name, request) if request else None
 
     def get_url(self, obj):
         # alias for frontend convenience
@@ -159,12 +276,15 @@ class CollectionEntrySerializer(serializers.ModelSerializer):
         fields = ['id', 'collection', 'media', 'media_id', 'caption', 'position']
 
 
-class CollectionSerializer(serializers.ModelSerializer):
+class CollectionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     entries = CollectionEntrySerializer(many=True, read_only=True)
 
     class Meta:
         model = Collection
         fields = '__all__'
+        expand_prefetch = {
+            'entries': Prefetch('entries', queryset=CollectionEntry.objects.select_related('media')),
+        }
 
 
 class ProductMediaLinkSerializer(serializers.ModelSerializer):
@@ -1,5 +1,13 @@
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.contrib.auth.models import User
+from django.db import transaction
+from base.cache import bump_catalog_version
+from base.search import index_product, unindex_product
+from base.changefeed import stamp_change
+from base.authentication import invalidate_user
+from django.db.models import Q
+from django.utils import timezone
+from base.models import Product, Review, ProductMedia, ProductMediaLink, Collection, CollectionEntry, Order
 
 def updateUser(sender, instance, **kwargs):
     user = instance
@@ -7,4 +15,63 @@ def updateUser(sender, instance, **kwargs):
         user.username = user.email
 
 
-pre_save.connect(updateUser,sender = User)
\ No newline at end of file
+pre_save.connect(updateUser,sender = User)
+
+
+def invalidateUser(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+post_save.connect(invalidateUser, sender=User)
+post_delete.connect(invalidateUser, sender=User)
+
+
+def invalidateCatalog(sender, **kwargs):
+    # Bump again on commit so pages rendered from pre-commit data are dropped too
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+for model in (Product, Review, ProductMedia, ProductMediaLink):
+    post_save.connect(invalidateCatalog, sender=model)
+    post_delete.connect(invalidateCatalog, sender=model)
+
+
+def indexProduct(sender, instance, **kwargs):
+    index_product(instance)
+
+
+def unindexProduct(sender, instance, **kwargs):
+    unindex_product(instance.pk)
+
+
+post_save.connect(indexProduct, sender=Product)
+post_delete.connect(unindexProduct, sender=Product)
+
+
+# Keep parent updatedAt current when rows embedded in their payloads change,
+# so conditional GETs on products and collections see those edits.
+def touchProduct(sender, instance, **kwargs):
+    Product.objects.filter(_id=instance.product_id).update(updatedAt=timezone.now())
+
+
+def touchCollection(sender, instance, **kwargs):
+    Collection.objects.filter(pk=instance.collection_id).update(updatedAt=timezone.now())
+
+
+def touchMediaOwners(sender, instance, **kwargs):
+    now = timezone.now()
+    Product.objects.filter(media_links__media_id=instance.pk).update(updatedAt=now)
+    Collection.objects.filter(Q(entries__media_id=instance.pk) | Q(hero_media_id=instance.pk)).update(updatedAt=now)
+
+
+for model, handler in ((Review, touchProduct), (ProductMediaLink, touchProduct), (CollectionEntry, touchCollection), (ProductMedia, touchMediaOwners)):
+    post_save.connect(handler, sender=model)
+    post_delete.connect(handler, sender=model)
+
+
+def stampOrderChange(sender, instance, **kwargs):
+    stamp_change(instance)
+
+
+post_save.connect(stampOrderChange, sender=Order)
@@ -1,3 +1,1297 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import json
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import EventStreamToken
+from .cache import get_cache, get_catalog_version
+from .management.commands.bench_renderers import Command as BenchRenderers
+from .events import ADMIN_CHANNEL, get_backend, order_message, user_channel
+from . import orderstate
+from .media_urls import media_url
+from .pagination import encode_cursor, keyset_page
+from .middleware import brotli, negotiate_encoding
+from .throttling import LocalBuckets, get_buckets
+from .models import Product, Review, Order, OrderItem, ShippingAddress, ProductVariant, ProductMedia, ProductMediaLink, Collection, CollectionEntry, StockReservation, OrderDailyRollup, IdempotencyKey
+from .renderers import FastJSONRenderer
+from .reservations import SWEEP_KEY, with_available
+from .rollups import rebuild_order_rollups
+from .search import search_products
+
+
+# A cache every worker would share; the default LocMemCache is per process,
+# so the catalog and user caches only use it when SINGLE_PROCESS is set
+SHARED_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.mkdtemp()}}
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def make_product(name, reviews=0, media=0, user=None):
+    product = Product.objects.create(name=name, price=10, countInStock=5, description='')
+    for i in range(reviews):
+        Review.objects.create(product=product, user=user, name='r', rating=4, comment='ok')
+    for i in range(media):
+        m = ProductMedia.objects.create(alt=f'{name} {i}')
+        ProductMediaLink.objects.create(product=product, media=m, position=i)
+    return product
+
+
+def make_order(user, items=1):
+    order = Order.objects.create(user=user, paymentMethod='PayPal', taxPrice=1, shippingPrice=1, totalPrice=12)
+    ShippingAddress.objects.create(order=order, address='1 Main', city='X', postalCode='1', country='US')
+    for i in range(items):
+        OrderItem.objects.create(order=order, name=f'item {i}', qty=1, price=10)
+    return order
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin@x.com', email='admin@x.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_product_list_is_constant(self):
+        make_product('a', reviews=1, media=1)
+        small = self.count_queries('/api/products/')
+        for i in range(10):
+            make_product(f'p{i}', reviews=5, media=3)
+        self.assertEqual(self.count_queries('/api/products/'), small)
+        # validators, count, products, reviews, media links
+        self.assertLessEqual(small, 5)
+
+    def test_product_detail_is_constant(self):
+        product = make_product('a', reviews=20, media=4)
+        self.assertLessEqual(self.count_queries(f'/api/products/{product._id}/'), 4)
+
+    def test_order_list_is_constant(self):
+        make_order(self.admin)
+        small = self.count_queries('/api/orders/')
+        small_mine = self.count_queries('/api/orders/myorders/')
+        for i in range(10):
+            make_order(self.admin, items=3)
+        self.assertEqual(self.count_queries('/api/orders/'), small)
+        self.assertEqual(self.count_queries('/api/orders/myorders/'), small_mine)
+
+    def test_collection_list_is_constant(self):
+        def make_collection(slug, entries):
+            c = Collection.objects.create(slug=slug)
+            for i in range(entries):
+                CollectionEntry.objects.create(collection=c, media=ProductMedia.objects.create(), position=i)
+        make_collection('one', 1)
+        small = self.count_queries('/api/products/collections/')
+        for i in range(5):
+            make_collection(f'c{i}', 4)
+        self.assertEqual(self.count_queries('/api/products/collections/'), small)
+
+
+@override_settings(CACHES=SHARED_CACHE)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.product = make_product('cached', reviews=1, media=1)
+
+    def test_repeat_request_is_served_from_cache(self):
+        self.client.get('/api/products/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.data['products'][0]['name'], 'cached')
+
+    def test_writes_invalidate_cached_pages(self):
+        url = f'/api/products/{self.product._id}/'
+        self.assertEqual(len(self.client.get(url).data['reviews']), 1)
+        Review.objects.create(product=self.product, name='r', rating=5)
+        self.assertEqual(len(self.client.get(url).data['reviews']), 2)
+
+        self.product.name = 'renamed'
+        self.product.save()
+        self.assertEqual(self.client.get('/api/products/').data['products'][0]['name'], 'renamed')
+
+    @override_settings(CACHES=LOCAL_CACHE, SINGLE_PROCESS=True)
+    def test_single_process_caches_in_local_memory(self):
+        self.client.get('/api/products/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/products/')
+
+    @override_settings(CACHES=LOCAL_CACHE, SINGLE_PROCESS=False)
+    def test_per_process_cache_is_not_used(self):
+        self.client.get('/api/products/')
+        Product.objects.filter(pk=self.product.pk).update(name='changed elsewhere')
+        self.assertEqual(self.client.get('/api/products/').data['products'][0]['name'], 'changed elsewhere')
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        Product.objects.create(name='Linen Shirt', description='Breathable summer layer')
+        Product.objects.create(name='Wool Coat', description='Pairs well with a linen shirt')
+        Product.objects.create(name='Silk Scarf', description='Hand rolled edges')
+
+    def names(self, url):
+        return [p['name'] for p in self.client.get(url).data['products']]
+
+    def test_ranks_name_matches_above_description_matches(self):
+        self.assertEqual(self.names('/api/products/?keyword=linen'), ['Linen Shirt', 'Wool Coat'])
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.names('/api/products/?keyword=sil'), ['Silk Scarf'])
+
+    def test_index_follows_product_updates(self):
+        scarf = Product.objects.get(name='Silk Scarf')
+        scarf.name = 'Cashmere Scarf'
+        scarf.save()
+        self.assertEqual(self.names('/api/products/?keyword=silk'), [])
+        self.assertEqual(self.names('/api/products/?keyword=cashmere'), ['Cashmere Scarf'])
+        scarf.delete()
+        self.assertEqual(self.names('/api/products/?keyword=cashmere'), [])
+
+    def test_explicit_sort_overrides_relevance(self):
+        self.assertEqual(self.names('/api/products/?keyword=linen&sort_by=name&order=desc'), ['Wool Coat', 'Linen Shirt'])
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        prices = [5, 5, 5, 12, None, 30, 7, 7, 50, 1, 5, 19, 19, 3, 8, 60, 5, 2]
+        for i, price in enumerate(prices):
+            Product.objects.create(name=f'p{i:02d}', price=price)
+
+    def walk(self, url):
+        pages, cursor = [], ''
+        while cursor is not None:
+            data = self.client.get(f'{url}&cursor={cursor}').data
+            pages.append(data)
+            cursor = data['next']
+        return pages
+
+    def test_walks_every_row_once_in_sort_order(self):
+        for order in ('asc', 'desc'):
+            pages = self.walk(f'/api/products/?sort_by=price&order={order}')
+            rows = [p for page in pages for p in page['products']]
+            self.assertEqual(len(rows), Product.objects.count())
+            self.assertEqual(len({p['_id'] for p in rows}), len(rows))
+            # NULL prices sort where the database's index puts them
+            null = float('inf') if connection.vendor == 'postgresql' else float('-inf')
+            keys = [(null if p['price'] is None else float(p['price']), p['_id']) for p in rows]
+            self.assertEqual(keys, sorted(keys, reverse=order == 'desc'))
+            self.assertNotIn('count', pages[0])
+
+    def test_walks_runs_of_null_sort_keys(self):
+        Product.objects.bulk_create(Product(name=f'n{i}', price=None) for i in range(10))
+        for order in ('asc', 'desc'):
+            pages = self.walk(f'/api/products/?sort_by=price&order={order}')
+            ids = [p['_id'] for page in pages for p in page['products']]
+            self.assertEqual(sorted(ids), sorted(Product.objects.values_list('_id', flat=True)))
+            back = self.client.get(f"/api/products/?sort_by=price&order={order}&cursor={pages[2]['prev']}").data
+            self.assertEqual(back['products'], pages[1]['products'])
+
+    def test_walks_tied_relevance_across_pages(self):
+        # Identical text, so every match has the same rank
+        for i in range(12):
+            Product.objects.create(name=f'Tie {i}', description='knit tie')
+        pages = self.walk('/api/products/?keyword=tie&sort_by=relevance')
+        ids = [p['_id'] for page in pages for p in page['products']]
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(ids, sorted(Product.objects.filter(name__startswith='Tie').values_list('_id', flat=True), reverse=True))
+
+    def test_prev_cursor_returns_previous_page(self):
+        pages = self.walk('/api/products/?sort_by=name')
+        back = self.client.get(f"/api/products/?sort_by=name&cursor={pages[1]['prev']}").data
+        self.assertEqual(back['products'], pages[0]['products'])
+
+    def test_count_is_opt_in(self):
+        data = self.client.get('/api/products/?cursor=&count=exact').data
+        self.assertEqual(data['count'], Product.objects.count())
+
+    def test_rejects_bad_or_mismatched_cursor(self):
+        self.assertEqual(self.client.get('/api/products/?cursor=garbage').status_code, 400)
+        cursor = self.client.get('/api/products/?sort_by=name&cursor=').data['next']
+        self.assertEqual(self.client.get(f'/api/products/?sort_by=price&cursor={cursor}').status_code, 400)
+        tampered = encode_cursor({'s': 'price', 'd': 'n', 'v': 'abc', 'pk': 1})
+        self.assertEqual(self.client.get(f'/api/products/?sort_by=price&cursor={tampered}').status_code, 400)
+
+    def test_admin_lists_accept_cursor(self):
+        self.client.force_authenticate(User.objects.create(username='a', is_staff=True))
+        for product in Product.objects.all()[:3]:
+            ProductVariant.objects.create(product=product, sku=None, stock=1)
+        data = self.client.get('/api/products/variants/?sort_by=sku&page_size=2&cursor=').data
+        rest = self.client.get(f"/api/products/variants/?sort_by=sku&page_size=2&cursor={data['next']}").data
+        self.assertEqual((len(data['results']), len(rest['results']), rest['next']), (2, 1, None))
+
+    def test_page_mode_is_unchanged(self):
+        data = self.client.get('/api/products/?page=2').data
+        self.assertEqual((data['page'], data['pages'], len(data['products'])), (2, 3, 8))
+
+
+class ReviewAggregateTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='rated')
+        self.client = APIClient()
+
+    def review(self, username, rating):
+        self.client.force_authenticate(User.objects.get_or_create(username=username)[0])
+        return self.client.post(f'/api/products/{self.product._id}/reviews/', {'rating': rating, 'comment': 'x'}, format='json')
+
+    def test_reviews_update_aggregates_incrementally(self):
+        self.assertEqual(self.review('a', 5).status_code, 201)
+        self.assertEqual(self.review('b', 4).status_code, 201)
+        self.assertEqual(self.review('c', 4).status_code, 201)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.numReviews, 3)
+        self.assertEqual(str(self.product.rating), '4.33')
+        self.assertEqual([self.product.stars4, self.product.stars5], [2, 1])
+
+    def test_duplicate_and_invalid_reviews_are_rejected(self):
+        self.review('a', 5)
+        self.assertEqual(self.review('a', 3).data['detail'], 'Product already reviewed')
+        self.assertEqual(self.review('b', 0).status_code, 400)
+        self.assertEqual(self.review('b', 9).status_code, 400)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.numReviews, self.product.stars5), (1, 1))
+
+    def test_rebuild_command_recomputes_from_reviews(self):
+        Review.objects.create(product=self.product, rating=2)
+        Review.objects.create(product=self.product, rating=3)
+        Product.objects.create(name='unrated', numReviews=7, rating=5)
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.numReviews, str(self.product.rating)), (2, '2.50'))
+        self.assertEqual((self.product.stars2, self.product.stars3), (1, 1))
+        self.assertEqual(Product.objects.get(name='unrated').numReviews, 0)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin@x.com', email='admin@x.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_product_fields_and_expand(self):
+        make_product('card', reviews=2, media=1)
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/api/products/?fields=_id,name,price,image_url,reviews').data
+        self.assertEqual(set(data['products'][0]), {'_id', 'name', 'price', 'image_url'})
+        self.assertNotIn('description', ctx.captured_queries[-1]['sql'])
+
+        data = self.client.get('/api/products/?fields=_id,name&expand=media').data
+        self.assertEqual(set(data['products'][0]), {'_id', 'name', 'media'})
+        self.assertEqual(len(data['products'][0]['media']), 1)
+
+    def test_order_fields_and_expand(self):
+        make_order(self.admin, items=2)
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/api/orders/?fields=_id,totalPrice&expand=user').data
+        self.assertEqual(set(data[0]), {'_id', 'totalPrice', 'user'})
+        self.assertEqual(data[0]['user']['email'], 'admin@x.com')
+        # validators + one joined select
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(len(self.client.get('/api/orders/').data[0]['orderItems']), 2)
+
+    def test_order_fields_with_reverse_one_to_one_expand(self):
+        make_order(self.admin)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/orders/?fields=_id,shippingAddress&expand=shippingAddress')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data[0]), {'_id', 'shippingAddress'})
+        self.assertEqual(response.data[0]['shippingAddress']['city'], 'X')
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+
+class ReviewListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_product('popular', reviews=23)
+
+    def test_product_embeds_summary_and_latest_reviews_only(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(f'/api/products/{self.product._id}/').data
+        self.assertEqual(len(data['reviews']), 5)
+        self.assertEqual(data['reviews'][0]['_id'], Review.objects.latest('_id')._id)
+        self.assertEqual(set(data['reviewSummary']), {'count', 'average', 'histogram'})
+        self.assertLessEqual(len(ctx.captured_queries), 4)
+
+    def test_reviews_are_cursor_paginated_newest_first(self):
+        seen, cursor = [], ''
+        while cursor is not None:
+            data = self.client.get(f'/api/products/{self.product._id}/reviews/?page_size=10&cursor={cursor}').data
+            seen += [r['_id'] for r in data['reviews']]
+            cursor = data['next']
+        self.assertEqual(seen, sorted(Review.objects.values_list('_id', flat=True), reverse=True))
+        self.assertEqual(self.client.get('/api/products/9999/reviews/').status_code, 404)
+
+    def test_posting_still_requires_login(self):
+        response = self.client.post(f'/api/products/{self.product._id}/reviews/', {'rating': 5}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin@x.com', email='admin@x.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_product_detail_revalidates(self):
+        product = make_product('etag')
+        url = f'/api/products/{product._id}/'
+        first = self.client.get(url)
+        self.assertIn('Last-Modified', first)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+        Review.objects.create(product=product, rating=3)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_product_list_etag_changes_on_delete(self):
+        make_product('a')
+        doomed = make_product('b')
+        etag = self.client.get('/api/products/')['ETag']
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        doomed.delete()
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_revalidation_is_authorized_first(self):
+        order = make_order(self.admin)
+        url = f'/api/orders/{order._id}/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.force_authenticate(User.objects.create(username='other'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        self.client.put(f'/api/orders/{order._id}/pay/')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_admin_lists_revalidate(self):
+        ProductVariant.objects.create(product=make_product('v'), sku='A')
+        etag = self.client.get('/api/products/variants/')['ETag']
+        self.assertEqual(self.client.get('/api/products/variants/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        etag = self.client.get('/api/orders/')['ETag']
+        self.assertEqual(self.client.get('/api/orders/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class MediaUrlTests(TestCase):
+    def test_matches_filesystem_storage_urls(self):
+        request = RequestFactory().get('/')
+        name = 'product_media/a b.jpg'
+        self.assertEqual(media_url(name, request), request.build_absolute_uri(default_storage.url(name)))
+        self.assertIsNone(media_url('', request))
+
+    def test_s3_custom_domain_skips_storage(self):
+        storages = {
+            'default': {
+                'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage',
+                'OPTIONS': {'location': 'media', 'custom_domain': 'cdn.example.com', 'querystring_auth': False},
+            },
+        }
+        with self.settings(STORAGES=storages):
+            self.assertEqual(media_url('x.jpg', RequestFactory().get('/')), 'https://cdn.example.com/media/x.jpg')
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN every hot lookup on a seeded database and fail on full table scans."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='buyer')
+        for i in range(200):
+            product = Product.objects.create(name=f'p{i}', price=i % 37, rating=i % 5, countInStock=i % 20)
+            Review.objects.create(product=product, user=cls.user, rating=4)
+            ProductMediaLink.objects.create(product=product, media=ProductMedia.objects.create(), position=i % 3)
+        for i in range(200):
+            Order.objects.create(user=cls.user if i % 4 == 0 else None, totalPrice=10)
+        User.objects.bulk_create([User(username=f'u{i}@x.com', email=f'u{i}@x.com', first_name=f'U{i}') for i in range(200)])
+        cls.product = Product.objects.first()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertIndexed(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+            self.assertNotIn('Seq Scan', plan, plan)
+        else:
+            plan = queryset.explain()
+            for line in plan.splitlines():
+                if ' SCAN ' in f' {line} ' and 'VIRTUAL TABLE' not in line:
+                    self.assertIn('USING', line, plan)
+
+    def assertPlanIndexed(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                self.assertNotIn('Seq Scan', plan, plan)
+                self.assertNotIn('Sort', plan, plan)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+                self.assertNotIn('TEMP B-TREE', plan, plan)
+                for line in plan.splitlines():
+                    if line.startswith('SCAN ') and 'VIRTUAL TABLE' not in line:
+                        self.assertIn('USING', line, plan)
+
+    def assertPagesIndexed(self, queryset, sort_by, descending):
+        # EXPLAIN the queries keyset_page actually runs, first page and a seek
+        with CaptureQueriesContext(connection) as ctx:
+            rows, next_cursor, _ = keyset_page(queryset, sort_by, descending, 8)
+            keyset_page(queryset, sort_by, descending, 8, next_cursor)
+        self.assertEqual(len(ctx.captured_queries), 2)
+        for query in ctx.captured_queries:
+            self.assertPlanIndexed(query['sql'])
+
+    def test_catalog_sorts(self):
+        for key in ('name', 'price', '-price', 'rating', '-rating'):
+            self.assertPagesIndexed(Product.objects.all(), key.lstrip('-'), key.startswith('-'))
+
+    def test_search_starts_from_the_index(self):
+        self.assertIndexed(search_products(Product.objects.all(), 'p1').order_by('-search_rank', '_id'))
+
+    def test_order_lookups(self):
+        self.assertIndexed(Order.objects.filter(createdAt__gte=timezone.now() - timedelta(days=30)))
+        self.assertIndexed(Order.objects.filter(user=self.user).order_by('-createdAt'))
+
+    def test_user_email_lookups(self):
+        self.assertIndexed(User.objects.filter(email__iexact='Buyer@x.com'))
+        self.assertIndexed(User.objects.filter(email__istartswith='buy'))
+
+    def test_work_queues(self):
+        for name in ('awaiting-payment', 'awaiting-fulfillment', 'refunded'):
+            orders, newest_first = orderstate.queue(name)
+            direction = '-' if newest_first else ''
+            self.assertIndexed(orders.order_by(f'{direction}createdAt', f'{direction}_id')[:50])
+
+    def test_review_and_media_lookups(self):
+        self.assertIndexed(Review.objects.filter(product=self.product, user=self.user))
+        self.assertIndexed(ProductMediaLink.objects.filter(product=self.product).order_by('position', 'id'))
+
+    def test_low_stock_uses_available_index(self):
+        self.assertIndexed(with_available(Product.objects.all()).filter(available__lt=5).order_by('available', '_id')[:10])
+
+
+class CheckoutTestCase(TestCase):
+    def setUp(self):
+        get_buckets().reset()
+        self.user = User.objects.create(username='buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shirt = Product.objects.create(name='Shirt', price=20, countInStock=3)
+        self.scarf = Product.objects.create(name='Scarf', price=10, countInStock=10)
+
+    def checkout(self, *lines):
+        return self.client.post('/api/orders/add/', {
+            'orderItems': [{'product': p._id, 'qty': qty, 'price': str(p.price)} for p, qty in lines],
+            'paymentMethod': 'PayPal', 'taxPrice': '1.00', 'shippingPrice': '0.00', 'totalPrice': '41.00',
+            'shippingAddress': {'address': '1 Main', 'city': 'X', 'postalCode': '1', 'country': 'US'},
+        }, format='json')
+
+
+class CheckoutTests(CheckoutTestCase):
+    def test_checkout_in_constant_queries(self):
+        # The day's first order also creates its analytics rollup row
+        self.checkout((self.scarf, 1))
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.checkout((self.shirt, 1)).status_code, 200)
+        extra = [Product.objects.create(name=f'x{i}', price=1, countInStock=5) for i in range(5)]
+        with CaptureQueriesContext(connection) as large:
+            response = self.checkout((self.shirt, 1), *[(p, 1) for p in extra])
+        self.assertEqual(len(response.data['orderItems']), 6)
+        # Only the per-product conditional stock update scales with the cart
+        self.assertEqual(len(large.captured_queries) - len(small.captured_queries), 5)
+
+    def test_stock_cannot_be_oversold(self):
+        self.assertEqual(self.checkout((self.shirt, 2), (self.scarf, 1)).status_code, 200)
+        response = self.checkout((self.scarf, 1), (self.shirt, 2))
+        self.assertEqual(response.status_code, 400)
+        self.shirt.refresh_from_db()
+        self.scarf.refresh_from_db()
+        # The failed order rolled back entirely, including the scarf hold
+        self.assertEqual((self.shirt.reservedStock, self.scarf.reservedStock), (2, 1))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_unknown_product(self):
+        Product.objects.filter(_id=self.shirt._id).delete()
+        self.assertEqual(self.checkout((self.shirt, 1)).status_code, 404)
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class ReservationTests(CheckoutTestCase):
+    def setUp(self):
+        super().setUp()
+        self.variant = ProductVariant.objects.create(product=self.shirt, sku='S-M', stock=2)
+
+    def test_paying_confirms_holds(self):
+        order_id = self.checkout((self.shirt, 2)).data['_id']
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.countInStock, self.shirt.reservedStock), (3, 2))
+        self.assertEqual(self.client.put(f'/api/orders/{order_id}/pay/').status_code, 200)
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.countInStock, self.shirt.reservedStock), (1, 0))
+        self.assertEqual(StockReservation.objects.get().status, 'confirmed')
+
+    def test_sweeper_releases_expired_holds(self):
+        self.checkout((self.shirt, 3))
+        self.assertEqual(self.checkout((self.shirt, 1)).status_code, 400)
+        StockReservation.objects.update(expiresAt=timezone.now() - timedelta(minutes=1))
+        call_command('release_expired_holds', stdout=StringIO())
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.countInStock, self.shirt.reservedStock), (3, 0))
+        self.assertEqual(self.checkout((self.shirt, 1)).status_code, 200)
+
+    def test_variant_stock_is_held(self):
+        def line(qty):
+            return {'product': self.shirt._id, 'variantId': self.variant.pk, 'qty': qty, 'price': '20.00'}
+        payload = {
+            'paymentMethod': 'PayPal', 'taxPrice': '0', 'shippingPrice': '0', 'totalPrice': '60',
+            'shippingAddress': {'address': '1 Main', 'city': 'X', 'postalCode': '1', 'country': 'US'},
+        }
+        self.assertEqual(self.client.post('/api/orders/add/', {**payload, 'orderItems': [line(3)]}, format='json').status_code, 400)
+        response = self.client.post('/api/orders/add/', {**payload, 'orderItems': [line(2)]}, format='json')
+        self.client.put(f"/api/orders/{response.data['_id']}/pay/")
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (0, 0))
+
+    def test_paying_after_holds_lapsed_and_sold_backorders(self):
+        order_id = self.checkout((self.shirt, 3)).data['_id']
+        StockReservation.objects.update(expiresAt=timezone.now() - timedelta(minutes=1))
+        get_cache().delete(SWEEP_KEY)
+        # The next checkout sweeps the lapsed hold and takes the units
+        other = self.checkout((self.shirt, 3)).data['_id']
+        self.assertEqual(self.client.put(f'/api/orders/{other}/pay/').status_code, 200)
+
+        response = self.client.put(f'/api/orders/{order_id}/pay/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['isBackordered'])
+        order = Order.objects.get(_id=order_id)
+        self.assertEqual((order.status, order.isBackordered), ('paid', True))
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.countInStock, self.shirt.reservedStock), (-3, 0))
+
+    def test_paying_after_holds_lapsed_retakes_free_stock(self):
+        order_id = self.checkout((self.shirt, 2)).data['_id']
+        StockReservation.objects.update(expiresAt=timezone.now() - timedelta(minutes=1))
+        get_cache().delete(SWEEP_KEY)
+        self.client.get(f'/api/products/availability/?ids={self.shirt._id}')
+        self.assertEqual(StockReservation.objects.get().status, 'released')
+        response = self.client.put(f'/api/orders/{order_id}/pay/')
+        self.assertNotIn('isBackordered', response.data)
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.countInStock, self.shirt.reservedStock), (1, 0))
+
+    @override_settings(CACHES=SHARED_CACHE)
+    def test_paying_refreshes_cached_stock(self):
+        get_cache().clear()
+        url = f'/api/products/{self.shirt._id}/'
+        self.assertEqual(self.client.get(url).data['countInStock'], 3)
+        version = get_catalog_version()
+        order_id = self.checkout((self.shirt, 1)).data['_id']
+        # A hold only moves reservedStock, which cached pages leave out
+        self.assertEqual(get_catalog_version(), version)
+        self.assertNotIn('reservedStock', self.client.get(url).data)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f'/api/orders/{order_id}/pay/')
+        self.assertEqual(self.client.get(url).data['countInStock'], 2)
+
+    def test_availability_reads_counters(self):
+        self.checkout((self.shirt, 1))
+        data = self.client.get(f'/api/products/availability/?ids={self.shirt._id}').data
+        self.assertEqual(data[0]['available'], 2)
+        self.assertEqual(data[0]['variants'], [{'id': self.variant.pk, 'available': 2}])
+
+
+class AdminOrderListTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin@x.com', email='admin@x.com', is_staff=True)
+        self.buyer = User.objects.create(username='b@x.com', email='b@x.com', first_name='Bea')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        for i in range(12):
+            order = make_order(self.buyer if i % 2 else self.admin, items=2)
+            Order.objects.filter(pk=order.pk).update(isPaid=i % 3 == 0, createdAt=timezone.now() - timedelta(days=i))
+
+    def test_filters(self):
+        self.assertEqual(len(self.client.get('/api/orders/?isPaid=true').data), 4)
+        self.assertEqual(len(self.client.get(f'/api/orders/?user={self.buyer.id}&isPaid=false').data), 4)
+        since = (timezone.now() - timedelta(days=2, hours=12)).isoformat()
+        self.assertEqual(len(self.client.get('/api/orders/', {'from': since}).data), 3)
+        self.assertEqual(self.client.get('/api/orders/?from=yesterday').status_code, 400)
+
+    def test_cursor_pages_cost_fixed_queries(self):
+        url = '/api/orders/?page_size=5&cursor='
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(url).data
+        self.assertEqual(len(data['results']), 5)
+        created = [o['createdAt'] for o in data['results']]
+        self.assertEqual(created, sorted(created, reverse=True))
+        # validators, orders joined with user and address, items
+        self.assertEqual(len(ctx.captured_queries), 3)
+        for i in range(20):
+            make_order(self.buyer, items=4)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+    def test_summary_mode(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(f'/api/orders/?summary=1&cursor=&user={self.buyer.id}').data
+        row = data['results'][0]
+        self.assertNotIn('orderItems', row)
+        self.assertEqual(row['userName'], 'Bea')
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+
+class OrderAnalyticsTests(CheckoutTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(self.admin)
+
+    def rollups(self):
+        return list(OrderDailyRollup.objects.order_by('day').values('day', 'orderCount', 'sales', 'paidCount', 'paidSales', 'deliveredCount', 'refunds'))
+
+    def test_rollups_follow_order_lifecycle(self):
+        first = self.checkout((self.shirt, 1)).data['_id']
+        self.checkout((self.scarf, 1))
+        self.client.put(f'/api/orders/{first}/pay/')
+        self.client.put(f'/api/orders/{first}/pay/')
+        self.admin_client.put(f'/api/orders/{first}/deliver/')
+        self.admin_client.put(f'/api/orders/{first}/refund/', {'amount': 5.5}, format='json')
+        row = OrderDailyRollup.objects.get()
+        self.assertEqual((row.orderCount, row.paidCount, row.deliveredCount), (2, 1, 1))
+        self.assertEqual((row.sales, row.paidSales, row.refunds), (82, 41, Decimal('5.50')))
+        incremental = self.rollups()
+        rebuild_order_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_series_is_bucketed_and_order_count_independent(self):
+        self.checkout((self.shirt, 1))
+        for i in range(6):
+            order = make_order(self.user)
+            Order.objects.filter(pk=order.pk).update(createdAt=timezone.now() - timedelta(days=i + 1), isPaid=True)
+        rebuild_order_rollups()
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.admin_client.get('/api/orders/analytics/?days=30').data
+        self.assertNotIn('orders', data)
+        self.assertEqual(len(data['series']), 7)
+        self.assertEqual(data['series'][-1]['period'], timezone.localdate())
+        self.assertEqual(data['totals']['orderCount'], 7)
+        self.assertEqual(data['totals']['netRevenue'], 72)
+
+        for i in range(10):
+            order = make_order(self.user)
+            Order.objects.filter(pk=order.pk).update(createdAt=timezone.now() - timedelta(days=2))
+        rebuild_order_rollups()
+        with CaptureQueriesContext(connection) as more:
+            data = self.admin_client.get('/api/orders/analytics/?days=30&bucket=month').data
+        self.assertEqual(len(more.captured_queries), len(ctx.captured_queries))
+        self.assertEqual(sum(row['orderCount'] for row in data['series']), 17)
+        self.assertLessEqual(len(data['series']), 2)
+
+    def test_invalid_bucket(self):
+        self.assertEqual(self.admin_client.get('/api/orders/analytics/?bucket=hour').status_code, 400)
+
+
+class DashboardSummaryTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.admin = User.objects.create(username='admin@x.com', email='admin@x.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def seed(self, n):
+        for i in range(n):
+            Product.objects.create(name=f'p{i}', price=10, countInStock=i % 4)
+            order = make_order(self.admin)
+            Order.objects.filter(pk=order.pk).update(
+                isPaid=i % 2 == 0, status='paid' if i % 2 == 0 else 'pending', createdAt=timezone.now() - timedelta(days=i))
+        rebuild_order_rollups()
+
+    def summary_queries(self):
+        get_cache().clear()
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/api/orders/dashboard/').data
+        return data, len(ctx.captured_queries)
+
+    def test_figures(self):
+        self.seed(8)
+        data, _ = self.summary_queries()
+        self.assertEqual(data['orders']['total'], 8)
+        self.assertEqual(data['orders']['awaitingPayment'], 4)
+        self.assertEqual(data['kpis']['week']['orderCount'], 7)
+        self.assertEqual(data['kpis']['year']['sales'], 96)
+        self.assertEqual(data['kpis']['today']['orderCount'], 1)
+        self.assertEqual(data['stock']['outOfStockCount'], 2)
+        self.assertEqual(data['stock']['lowStockProducts'][0]['countInStock'], 0)
+        self.assertEqual(len(data['recentOrders']), 8)
+        self.assertEqual(data['kpis']['quarter']['orderCount'], 8)
+        self.assertEqual(sum(row['orderCount'] for row in data['revenue']), 8)
+        self.assertEqual(data['recentUsers'][0]['email'], 'admin@x.com')
+
+    def test_top_products(self):
+        best = Product.objects.create(name='best', price=10, countInStock=10)
+        other = Product.objects.create(name='other', price=10, countInStock=10)
+        order = make_order(self.admin)
+        OrderItem.objects.create(order=order, product=best, name='best', qty=3, price=10)
+        OrderItem.objects.create(order=order, product=other, name='other', qty=1, price=10)
+        data, _ = self.summary_queries()
+        top = {row['product_id']: row for row in data['topProducts']}
+        self.assertEqual(data['topProducts'][0]['product_id'], best._id)
+        self.assertEqual((top[best._id]['units'], top[best._id]['revenue']), (3, 30))
+
+    def test_held_units_count_against_stock(self):
+        held = Product.objects.create(name='held', price=10, countInStock=20, reservedStock=20)
+        Product.objects.create(name='plenty', price=10, countInStock=20, reservedStock=2)
+        data, _ = self.summary_queries()
+        self.assertEqual(data['stock']['outOfStockCount'], 1)
+        self.assertEqual([p['_id'] for p in data['stock']['lowStockProducts']], [held._id])
+        self.assertEqual(data['stock']['lowStockProducts'][0]['available'], 0)
+
+    def test_bounded_queries_and_cached(self):
+        self.seed(3)
+        _, small = self.summary_queries()
+        self.seed(20)
+        data, large = self.summary_queries()
+        self.assertEqual(small, large)
+        self.assertEqual(len(data['recentOrders']), 10)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/orders/dashboard/')
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_admin_only(self):
+        self.client.force_authenticate(User.objects.create(username='shopper'))
+        self.assertEqual(self.client.get('/api/orders/dashboard/').status_code, 403)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin@x.com', email='admin@x.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.paid = make_order(self.admin, items=3)
+        Order.objects.filter(pk=self.paid.pk).update(isPaid=True)
+        self.bare = Order.objects.create(user=self.admin, totalPrice=5)
+
+    def read(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_has_a_row_per_item(self):
+        lines = self.read('/api/orders/export/csv/').splitlines()
+        self.assertTrue(lines[0].startswith('orderId,createdAt,userEmail'))
+        self.assertEqual(len(lines), 1 + 3 + 1)
+        self.assertIn('1 Main', lines[1])
+
+    def test_ndjson_filters(self):
+        rows = [json.loads(line) for line in self.read('/api/orders/export/ndjson/?isPaid=true').splitlines()]
+        self.assertEqual({row['orderId'] for row in rows}, {self.paid._id})
+        self.assertEqual(rows[0]['city'], 'X')
+        self.assertEqual(self.client.get('/api/orders/export/ndjson/?from=soon').status_code, 400)
+        self.assertEqual(self.client.get('/api/orders/export/xml/').status_code, 400)
+
+    async def test_streams_asynchronously_under_asgi(self):
+        token = str(RefreshToken.for_user(self.admin).access_token)
+        response = await AsyncClient().get('/api/orders/export/csv/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        # An async iterator is streamed as it goes; a sync one would be read in full first
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(len(lines), 1 + 3 + 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_orders', '--format', 'ndjson', '--is-paid', 'false', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertIsNone(rows[0]['itemId'])
+
+
+class IdempotencyTests(CheckoutTestCase):
+    def test_retried_checkout_is_replayed(self):
+        first = self.client.post('/api/orders/add/', self.payload(), format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.client.post('/api/orders/add/', self.payload(), format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['_id'], first.data['_id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.reservedStock, 1)
+
+    def test_key_reuse_with_other_body_is_rejected(self):
+        self.client.post('/api/orders/add/', self.payload(), format='json', HTTP_IDEMPOTENCY_KEY='k2')
+        response = self.client.post('/api/orders/add/', self.payload(qty=2), format='json', HTTP_IDEMPOTENCY_KEY='k2')
+        self.assertEqual(response.status_code, 422)
+
+    def test_payment_marked_once(self):
+        order_id = self.checkout((self.shirt, 1)).data['_id']
+        for _ in range(2):
+            response = self.client.put(f'/api/orders/{order_id}/pay/', HTTP_IDEMPOTENCY_KEY='pay-1')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(OrderDailyRollup.objects.get().paidCount, 1)
+
+    def test_in_flight_duplicate_is_not_executed(self):
+        IdempotencyKey.objects.create(user=self.user, key='k3', scope='POST /api/orders/add/',
+                                      fingerprint=_fingerprint_of(self.payload()),
+                                      expiresAt=timezone.now() + timedelta(hours=1))
+        with mock.patch('time.sleep') as sleep:
+            response = self.client.post('/api/orders/add/', self.payload(), format='json', HTTP_IDEMPOTENCY_KEY='k3')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        sleep.assert_not_called()
+        self.assertEqual(Order.objects.count(), 0)
+
+    def payload(self, qty=1):
+        return {
+            'orderItems': [{'product': self.shirt._id, 'qty': qty, 'price': '20.00'}],
+            'paymentMethod': 'PayPal', 'taxPrice': '1.00', 'shippingPrice': '0.00', 'totalPrice': '21.00',
+            'shippingAddress': {'address': '1 Main', 'city': 'X', 'postalCode': '1', 'country': 'US'},
+        }
+
+
+def _fingerprint_of(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class OrderChangeFeedTests(CheckoutTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(self.admin)
+
+    def sync(self, since, client=None, url='/api/orders/myorders/'):
+        response = (client or self.client).get(url, {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_only_changes_after_cursor(self):
+        # Orders are stamped once their transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.checkout((self.shirt, 1)).data['_id']
+            second = self.checkout((self.scarf, 1)).data['_id']
+            make_order(self.admin)
+        data = self.sync(0)
+        self.assertEqual([o['_id'] for o in data['results']], [first, second])
+
+        cursor = data['cursor']
+        with CaptureQueriesContext(connection) as ctx:
+            idle = self.sync(cursor)
+        self.assertEqual((idle['results'], idle['cursor']), ([], cursor))
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f'/api/orders/{first}/pay/')
+            self.client.put(f'/api/orders/{second}/pay/')
+            self.admin_client.put(f'/api/orders/{second}/deliver/')
+            self.admin_client.put(f'/api/orders/{first}/refund/', {'amount': 1}, format='json')
+        data = self.sync(cursor)
+        self.assertEqual([o['_id'] for o in data['results']], [second, first])
+        self.assertTrue(data['results'][1]['isPaid'])
+
+    def test_counter_is_not_locked_inside_checkout(self):
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as ctx:
+            order_id = self.checkout((self.shirt, 1)).data['_id']
+        self.assertFalse([q for q in ctx.captured_queries if 'base_changesequence' in q['sql']])
+        self.assertEqual(self.sync(0)['results'], [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual([o['_id'] for o in self.sync(0)['results']], [order_id])
+
+    def test_admin_feed_pages_and_validates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                make_order(self.user)
+        data = self.admin_client.get('/api/orders/', {'since': 0, 'limit': 2, 'summary': 1}).data
+        self.assertEqual(len(data['results']), 2)
+        self.assertTrue(data['hasMore'])
+        rest = self.sync(data['cursor'], self.admin_client, '/api/orders/')
+        self.assertEqual(len(rest['results']), 1)
+        self.assertFalse(rest['hasMore'])
+        self.assertEqual(self.admin_client.get('/api/orders/?since=abc').status_code, 400)
+
+
+class OrderEventStreamTests(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer')
+        self.other = User.objects.create(username='other')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = make_order(self.buyer)
+            self.other_order = make_order(self.other)
+        self.token = str(EventStreamToken.for_user(self.buyer))
+
+    async def open_stream(self, token, **headers):
+        response = await AsyncClient().get('/api/orders/events/', {'token': token}, headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        return stream
+
+    async def test_owner_receives_status_transitions(self):
+        stream = await self.open_stream(self.token)
+        get_backend().publish(user_channel(self.other.id), order_message(self.other_order, 'paid'))
+        get_backend().publish(user_channel(self.buyer.id), order_message(self.order, 'delivered'))
+        chunk = (await anext(stream)).decode()
+        self.assertIn('event: order', chunk)
+        payload = json.loads(chunk.split('data: ', 1)[1])
+        self.assertEqual((payload['orderId'], payload['event']), (self.order._id, 'delivered'))
+        await stream.aclose()
+
+    async def test_resume_replays_missed_changes(self):
+        stream = await self.open_stream(self.token, **{'Last-Event-ID': '0'})
+        chunk = (await anext(stream)).decode()
+        self.assertTrue(chunk.startswith(f'id: {self.order.changeSeq}\n'))
+        self.assertIn('"event": "sync"', chunk)
+        await stream.aclose()
+
+    async def test_requires_token(self):
+        response = await AsyncClient().get('/api/orders/events/', {'token': 'nope'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_query_string_only_takes_stream_tokens(self):
+        access = str(RefreshToken.for_user(self.buyer).access_token)
+        response = await AsyncClient().get('/api/orders/events/', {'token': access})
+        self.assertEqual(response.status_code, 401)
+        stream = await AsyncClient().get('/api/orders/events/', headers={'Authorization': f'Bearer {access}'})
+        self.assertEqual(stream['Content-Type'], 'text/event-stream')
+        await aiter(stream.streaming_content).aclose()
+
+    def test_stream_token_endpoint(self):
+        client = APIClient()
+        self.assertEqual(client.post('/api/orders/events/token/').status_code, 401)
+        client.force_authenticate(self.buyer)
+        data = client.post('/api/orders/events/token/').data
+        self.assertEqual(data['expiresIn'], 120)
+        token = EventStreamToken(data['token'])
+        self.assertEqual(token['user_id'], self.buyer.id)
+        self.assertLessEqual(token['exp'] - token['iat'], 120)
+
+    def test_transitions_publish_after_commit(self):
+        admin = User.objects.create(username='admin', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        Order.objects.filter(pk=self.order.pk).update(status='paid', isPaid=True)
+        published = []
+        with mock.patch.object(get_backend(), 'publish', lambda channel, message: published.append(channel)):
+            with self.captureOnCommitCallbacks(execute=True):
+                client.put(f'/api/orders/{self.order._id}/deliver/')
+        self.assertEqual(published, [ADMIN_CHANNEL, user_channel(self.buyer.id)])
+
+
+class OrderStatusTests(CheckoutTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(self.admin)
+
+    def test_transitions_follow_the_state_machine(self):
+        order_id = self.checkout((self.shirt, 1)).data['_id']
+        self.assertEqual(self.admin_client.put(f'/api/orders/{order_id}/deliver/').status_code, 409)
+        self.assertEqual(self.admin_client.put(f'/api/orders/{order_id}/refund/', {'amount': 1}, format='json').status_code, 409)
+        self.assertEqual(self.client.put(f'/api/orders/{order_id}/pay/').status_code, 200)
+        self.assertEqual(self.client.put(f'/api/orders/{order_id}/pay/').status_code, 409)
+        self.assertEqual(self.admin_client.put(f'/api/orders/{order_id}/deliver/').status_code, 200)
+        for _ in range(2):
+            self.admin_client.put(f'/api/orders/{order_id}/refund/', {'amount': 2.5}, format='json')
+        order = Order.objects.get(pk=order_id)
+        # Partial refunds leave the fulfillment status alone
+        self.assertEqual((order.status, order.isPaid, order.isDelivered), ('delivered', True, True))
+        self.assertEqual(order.refundTotal, Decimal('5.00'))
+        self.admin_client.put(f'/api/orders/{order_id}/refund/', {'amount': 36}, format='json')
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.refundTotal), ('refunded', Decimal('41.00')))
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.countInStock, self.shirt.reservedStock), (2, 0))
+
+    def test_refunds_cannot_exceed_the_total(self):
+        order_id = self.checkout((self.shirt, 1)).data['_id']
+        self.client.put(f'/api/orders/{order_id}/pay/')
+        self.assertEqual(self.admin_client.put(f'/api/orders/{order_id}/refund/', {'amount': 40}, format='json').status_code, 200)
+        self.assertEqual(self.admin_client.put(f'/api/orders/{order_id}/refund/', {'amount': 2}, format='json').status_code, 400)
+        self.assertEqual(Order.objects.get(pk=order_id).refundTotal, Decimal('40.00'))
+        self.assertEqual(self.admin_client.put(f'/api/orders/{order_id}/refund/', {'amount': 1}, format='json').status_code, 200)
+        # Fully refunded orders take no further refunds
+        self.assertEqual(self.admin_client.put(f'/api/orders/{order_id}/refund/', {'amount': 1}, format='json').status_code, 409)
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.status, order.refundTotal), ('refunded', Decimal('41.00')))
+        totals = self.admin_client.get('/api/orders/analytics/?days=1').data['totals']
+        self.assertEqual(totals['netRevenue'], 0)
+
+    def test_partially_refunded_order_can_still_be_delivered(self):
+        order_id = self.checkout((self.shirt, 1)).data['_id']
+        self.client.put(f'/api/orders/{order_id}/pay/')
+        self.assertEqual(self.admin_client.put(f'/api/orders/{order_id}/refund/', {'amount': 1}, format='json').status_code, 200)
+        data = self.admin_client.get('/api/orders/queues/awaiting-fulfillment/?cursor=').data
+        self.assertEqual([o['_id'] for o in data['results']], [order_id])
+        self.assertEqual(self.admin_client.put(f'/api/orders/{order_id}/deliver/').status_code, 200)
+
+    def test_queues(self):
+        waiting = [make_order(self.user) for _ in range(3)]
+        Order.objects.filter(pk=waiting[0].pk).update(status='paid')
+        Order.objects.filter(pk=waiting[1].pk).update(status='delivered')
+        data = self.admin_client.get('/api/orders/queues/awaiting-fulfillment/?cursor=').data
+        self.assertEqual([o['_id'] for o in data['results']], [waiting[0]._id])
+        data = self.admin_client.get('/api/orders/queues/awaiting-payment/?cursor=').data
+        self.assertEqual([o['_id'] for o in data['results']], [waiting[2]._id])
+        self.assertEqual(self.admin_client.get('/api/orders/queues/lost/').status_code, 404)
+        self.assertEqual(self.client.get('/api/orders/queues/refunded/').status_code, 403)
+
+
+@override_settings(CACHES=SHARED_CACHE)
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create(username='a@x.com', email='a@x.com', first_name='Ann', password=make_password('secret'))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def auth_queries(self, url='/api/users/profile/'):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in ctx.captured_queries if 'auth_user' in q['sql']]
+
+    def test_identity_is_served_from_cache(self):
+        response, queries = self.auth_queries()
+        self.assertEqual((response.status_code, len(queries)), (200, 1))
+        response, queries = self.auth_queries()
+        self.assertEqual((response.data['name'], queries), ('Ann', []))
+
+    def test_saves_and_deletes_invalidate(self):
+        self.auth_queries()
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get('/api/users/').status_code, 200)
+        self.user.delete()
+        self.assertEqual(self.client.get('/api/users/profile/').status_code, 401)
+
+    def test_profile_update_keeps_uncached_columns(self):
+        self.auth_queries()
+        response = self.client.put('/api/users/profile/update/', {'name': 'Anna', 'email': 'a@x.com'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Anna')
+        self.assertTrue(self.user.check_password('secret'))
+        self.assertEqual(self.auth_queries()[0].data['name'], 'Anna')
+
+    @override_settings(CACHES=LOCAL_CACHE, SINGLE_PROCESS=True)
+    def test_single_process_caches_in_local_memory(self):
+        get_cache().clear()
+        self.auth_queries()
+        self.assertEqual(len(self.auth_queries()[1]), 0)
+
+    @override_settings(CACHES=LOCAL_CACHE, SINGLE_PROCESS=False)
+    def test_per_process_cache_is_not_used(self):
+        self.auth_queries()
+        # A demotion saved by another worker would not clear this worker's memory
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.auth_queries()[0].status_code, 401)
+
+
+class UserDirectoryTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin@x.com', email='admin@x.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        for i in range(6):
+            buyer = User.objects.create(username=f'buyer{i}@x.com', email=f'buyer{i}@x.com', first_name=f'Zed{i}')
+            for paid in range(i):
+                order = make_order(buyer)
+                Order.objects.filter(pk=order.pk).update(isPaid=paid % 2 == 0)
+
+    def test_annotations_in_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/api/users/?cursor=&sort_by=orderCount&order=desc&page_size=2').data
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual([(u['email'], u['orderCount']) for u in data['results']], [('buyer5@x.com', 5), ('buyer4@x.com', 4)])
+        self.assertEqual(Decimal(data['results'][0]['lifetimeSpend']), 36)
+        rest = self.client.get('/api/users/', {'cursor': data['next'], 'sort_by': 'orderCount', 'order': 'desc', 'page_size': 2}).data
+        self.assertEqual([u['orderCount'] for u in rest['results']], [3, 2])
+
+    def test_prefix_search(self):
+        self.assertEqual(len(self.client.get('/api/users/?search=BUYER').data), 6)
+        self.assertEqual([u['name'] for u in self.client.get('/api/users/?search=zed3').data], ['Zed3'])
+        self.assertEqual(self.client.get('/api/users/?search=x.com').data, [])
+
+    def test_registration_duplicate_check_ignores_case(self):
+        response = self.client.post('/api/users/register/', {'name': 'B', 'email': 'Buyer1@X.com', 'password': 'pw'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(THROTTLE_RATES={'login': '3/min', 'login_failures': '2/min', 'register': '2/min', 'search': '2/min', 'checkout': '1/min'})
+class ThrottleTests(CheckoutTestCase):
+    def test_bucket_refills_at_the_sustained_rate(self):
+        buckets = LocalBuckets()
+        self.assertEqual([buckets.take(['k'], 2, 1, 100) for _ in range(3)], [0, 0, 1])
+        self.assertEqual(buckets.take(['k'], 2, 1, 100.5), 0.5)
+        self.assertEqual(buckets.take(['k'], 2, 1, 101.5), 0)
+
+    def test_refused_take_spends_no_bucket(self):
+        buckets = LocalBuckets()
+        buckets.take(['empty'], 1, 0.1, 100)
+        self.assertGreater(buckets.take(['full', 'empty'], 1, 0.1, 100), 0)
+        self.assertEqual(buckets.take(['full'], 1, 0.1, 100), 0)
+        self.assertEqual(buckets.take(['other'], 1, 0.1, 100, spend=False), 0)
+        self.assertEqual(buckets.take(['other'], 1, 0.1, 100), 0)
+
+    def test_local_buckets_evict_least_recently_used(self):
+        buckets = LocalBuckets(max_keys=2)
+        buckets.take(['a'], 1, 0.1, 100)
+        buckets.take(['b'], 1, 0.1, 100)
+        self.assertGreater(buckets.take(['a'], 1, 0.1, 100), 0)
+        buckets.take(['c'], 1, 0.1, 100)
+        # 'b' was the least recently used, so it went; 'a' is still empty
+        self.assertEqual(list(buckets._buckets), ['a', 'c'])
+        self.assertGreater(buckets.take(['a'], 1, 0.1, 100), 0)
+
+    def test_forwarded_for_cannot_be_spoofed(self):
+        for i in range(3):
+            APIClient().post('/api/users/login/', {'username': f'nobody{i}@x.com', 'password': 'x'},
+                             HTTP_X_FORWARDED_FOR=f'6.6.6.{i}, 198.51.100.7')
+        response = APIClient().post('/api/users/login/', {'username': 'nobody9@x.com', 'password': 'x'},
+                                    HTTP_X_FORWARDED_FOR='6.6.6.9, 198.51.100.7')
+        self.assertEqual(response.status_code, 429)
+
+    def test_login_is_limited_per_ip(self):
+        anon = APIClient()
+        for i in range(3):
+            anon.post('/api/users/login/', {'username': f'nobody{i}@x.com', 'password': 'x'})
+        response = anon.post('/api/users/login/', {'username': 'nobody9@x.com', 'password': 'x'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(int(response['Retry-After']), range(1, 21))
+
+    def test_failed_logins_limit_the_account_from_that_ip_only(self):
+        User.objects.create_user(username='target@x.com', password='right-password')
+        guesser = APIClient(REMOTE_ADDR='10.0.0.1')
+        for _ in range(2):
+            self.assertEqual(guesser.post('/api/users/login/', {'username': 'target@x.com', 'password': 'x'}).status_code, 401)
+        self.assertEqual(guesser.post('/api/users/login/', {'username': 'Target@x.com', 'password': 'x'}).status_code, 429)
+        # The owner, elsewhere, is not locked out, and the refusal spent no IP token
+        owner = APIClient(REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(owner.post('/api/users/login/', {'username': 'target@x.com', 'password': 'right-password'}).status_code, 200)
+        self.assertEqual(guesser.post('/api/users/login/', {'username': 'other@x.com', 'password': 'x'}).status_code, 401)
+
+    def test_login_with_a_non_object_body(self):
+        self.assertEqual(APIClient().post('/api/users/login/', ['a'], format='json').status_code, 400)
+        self.assertEqual(APIClient().post('/api/users/login/', '"a"', content_type='application/json').status_code, 400)
+
+    def test_search_and_checkout(self):
+        anon = APIClient()
+        for _ in range(2):
+            self.assertEqual(anon.get('/api/products/?keyword=shirt').status_code, 200)
+        self.assertEqual(anon.get('/api/products/?keyword=shirt').status_code, 429)
+        self.assertEqual(anon.get('/api/products/').status_code, 200)
+
+        self.assertEqual(self.checkout((self.scarf, 1)).status_code, 200)
+        response = self.checkout((self.scarf, 1))
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+class APIMiddlewareTests(TestCase):
+    def test_api_requests_skip_browser_middleware(self):
+        make_product('a')
+        with mock.patch('django.contrib.sessions.middleware.SessionMiddleware.process_request') as session, \
+                mock.patch('django.middleware.csrf.CsrfViewMiddleware.process_view') as csrf_view:
+            response = self.client.get('/api/products/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        session.assert_not_called()
+        csrf_view.assert_not_called()
+        self.assertNotIn('csrftoken', response.cookies)
+
+    # The admin login page links static files; don't depend on collectstatic's manifest
+    @override_settings(STORAGES={**settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+    def test_admin_keeps_sessions_and_csrf(self):
+        response = self.client.get('/admin/login/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('csrftoken', response.cookies)
+        strict = Client(enforce_csrf_checks=True)
+        self.assertEqual(strict.post('/admin/login/', {'username': 'x', 'password': 'y'}, secure=True).status_code, 403)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('bench_middleware', '--requests', '5', '--rounds', '1', stdout=out)
+        self.assertIn('saved:', out.getvalue())
+
+
+class RendererTests(TestCase):
+    def test_fast_renderer_matches_stock_output(self):
+        data = {'price': Decimal('19.99'), 'day': timezone.localdate(), 'name': 'café', 1: [None, True, 2.5]}
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_utc_datetimes_use_z_suffix(self):
+        when = timezone.now().replace(microsecond=0)
+        rendered = json.loads(FastJSONRenderer().render({'at': when}))
+        self.assertEqual(rendered['at'], when.isoformat().replace('+00:00', 'Z'))
+
+    def test_indent_falls_back_to_stock_renderer(self):
+        rendered = FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+
+
+class CompressionTests(TestCase):
+    def setUp(self):
+        for i in range(8):
+            make_product(f'product {i}')
+            Product.objects.filter(name=f'product {i}').update(description='A long description. ' * 20)
+
+    def test_large_api_responses_are_gzipped(self):
+        response = self.client.get('/api/products/', secure=True, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        body = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(body['products']), 8)
+        # The weak validator still revalidates
+        again = self.client.get('/api/products/', secure=True, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_uncompressed_without_accept_encoding_or_below_threshold(self):
+        response = self.client.get('/api/products/', secure=True)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(len(json.loads(response.content)['products']), 8)
+        with override_settings(COMPRESSION_MIN_SIZE=10 ** 6):
+            response = self.client.get('/api/products/', secure=True, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_negotiation(self):
+        self.assertEqual(negotiate_encoding('gzip;q=0, deflate'), None)
+        self.assertEqual(negotiate_encoding('*'), 'br' if brotli else 'gzip')
+        self.assertEqual(negotiate_encoding('br;q=0.5, gzip'), 'gzip')
+        self.assertEqual(negotiate_encoding('gzip, br'), 'br' if brotli else 'gzip')
+
+    def test_benchmark_command(self):
+        # handle() builds its own test database, so run the benchmark body in this one
+        out = StringIO()
+        BenchRenderers(stdout=out).run_benchmark(orders=3, items=2, products=9, rounds=1)
+        self.assertIn('getOrders', out.getvalue())
+        self.assertIn('getProducts x2 pages', out.getvalue())
@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+# Token-bucket throttles. A rate of '10/min' is a bucket of 10 tokens that
+# refills at 10 per minute, so clients may burst up to the capacity and then
+# continue at the sustained rate. Rates live in settings.THROTTLE_RATES; a
+# scope without a rate is not throttled.
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'10/min' -> (capacity, tokens refilled per second)."""
+    count, _, period = rate.partition('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalBuckets:
+    """Buckets in this process's memory, at most max_keys of them. Each check
+    is O(1) under a lock; past the limit the least recently used bucket is
+    dropped, so a flood of new keys costs the same per call as normal use."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, keys, capacity, refill, now, spend=True):
+        """Spend a token from every bucket in keys, or from none of them.
+        Returns 0 if each had one, otherwise the seconds until all will.
+        spend=False only checks."""
+        with self._lock:
+            levels = []
+            for key in keys:
+                tokens, stamp = self._buckets.pop(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - stamp) * refill))
+            wait = max(((1 - tokens) / refill for tokens in levels if tokens < 1), default=0)
+            spent = 1 if spend and not wait else 0
+            for key, tokens in zip(keys, levels):
+                self._buckets[key] = (tokens - spent, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBuckets:
+    """Buckets shared by every worker, updated atomically by a Lua script.
+    Uses THROTTLE_URL (requires the `redis` package)."""
+
+    SCRIPT = """
+    local capacity, refill, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local levels, wait = {}, 0
+    for i, key in ipairs(KEYS) do
+        local bucket = redis.call('HMGET', key, 't', 's')
+        levels[i] = math.min(capacity, (tonumber(bucket[1]) or capacity) + (now - (tonumber(bucket[2]) or now)) * refill)
+        if levels[i] < 1 then wait = math.max(wait, (1 - levels[i]) / refill) end
+    end
+    local spent = 0
+    if ARGV[4] == '1' and wait == 0 then spent = 1 end
+    for i, key in ipairs(KEYS) do
+        redis.call('HSET', key, 't', levels[i] - spent, 's', now)
+        redis.call('EXPIRE', key, math.ceil(capacity / refill) + 1)
+    end
+    return tostring(wait)
+    """
+
+    def __init__(self):
+        import redis
+
+        self.client = redis.Redis.from_url(settings.THROTTLE_URL)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def take(self, keys, capacity, refill, now, spend=True):
+        return float(self.script(keys=keys, args=[capacity, refill, now, int(spend)]))
+
+    def reset(self):
+        for key in self.client.scan_iter('throttle:*'):
+            self.client.delete(key)
+
+
+@lru_cache(maxsize=None)
+def get_buckets():
+    return import_string(getattr(settings, 'THROTTLE_BACKEND', 'base.throttling.LocalBuckets'))()
+
+
+class BucketThrottle(BaseThrottle):
+    """Per-user token bucket for authenticated requests, per-IP otherwise."""
+    scope = None
+
+    def applies(self, request):
+        return True
+
+    def get_idents(self, request):
+        if request.user and request.user.is_authenticated:
+            return [f'user:{request.user.pk}']
+        return [f'ip:{self.get_ident(request)}']
+
+    def allow_request(self, request, view):
+        rate = getattr(settings, 'THROTTLE_RATES', {}).get(self.scope)
+        if not rate or not self.applies(request):
+            return True
+        capacity, refill = parse_rate(rate)
+        keys = [f'throttle:{self.scope}:{ident}' for ident in self.get_idents(request)]
+        self.wait_seconds = get_buckets().take(keys, capacity, refill, time.time())
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginThrottle(BucketThrottle):
+    # Every attempt spends from the per-IP bucket. Failed attempts also spend
+    # from a bucket per (account, IP), so guessing one account's password is
+    # slower still, yet nobody elsewhere can lock its owner out.
+    scope = 'login'
+    failure_scope = 'login_failures'
+
+    def failure_key(self, request):
+        data = request.data if isinstance(request.data, dict) else {}
+        username = str(data.get('username', '')).strip().lower()
+        if not username:
+            return None
+        return f'throttle:{self.failure_scope}:{username}:{self.get_ident(request)}'
+
+    def failure_take(self, request, spend):
+        rate = getattr(settings, 'THROTTLE_RATES', {}).get(self.failure_scope)
+        key = self.failure_key(request)
+        if not rate or not key:
+            return 0
+        capacity, refill = parse_rate(rate)
+        return get_buckets().take([key], capacity, refill, time.time(), spend=spend)
+
+    def allow_request(self, request, view):
+        # Checked before the IP bucket so a refused attempt spends nothing
+        self.wait_seconds = self.failure_take(request, spend=False)
+        if self.wait_seconds:
+            return False
+        return super().allow_request(request, view)
+
+    def record_failure(self, request):
+        self.failure_take(request, spend=True)
+
+
+class RegisterThrottle(BucketThrottle):
+    scope = 'register'
+
+
+class SearchThrottle(BucketThrottle):
+    # Plain catalog browsing is cached; only keyword searches hit the index
+    scope = 'search'
+
+    def applies(self, request):
+        return bool(request.query_params.get('keyword', '').strip())
+
+
+class CheckoutThrottle(BucketThrottle):
+    scope = 'checkout'
@@ -6,6 +6,11 @@ urlpatterns = [
 
     path('', views.getOrders, name='orders'),
     path('analytics/', views.ordersAnalytics, name='orders-analytics'),
+    path('dashboard/', views.dashboardSummary, name='orders-dashboard'),
+    path('export/<str:fmt>/', views.exportOrders, name='orders-export'),
+    path('events/', views.orderEvents, name='orders-events'),
+    path('events/token/', views.orderEventsToken, name='orders-events-token'),
+    path('queues/<str:name>/', views.orderQueue, name='orders-queue'),
     path('add/', views.addOrderItems, name='orders-add'),
     path('myorders/', views.getMyOrders, name='myorders'),
 
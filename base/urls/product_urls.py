@@ -31,11 +31,14 @@ urlpatterns = [
     path('media-links/<int:pk>/delete/', views.deleteProductMediaLink, name='product-media-link-delete'),
     path('<int:product_pk>/media-links/reorder/', views.reorderProductMedia, name='product-media-reorder'),
 
+    path('cache/stats/', views.catalogCacheStats, name='catalog-cache-stats'),
+    path('availability/', views.getAvailability, name='product-availability'),
+
     # Public product endpoints
     path('', views.getProducts, name='products'),
     path('create/', views.createProduct, name='product-create'),
     path('upload/', views.uploadImage, name="image-upload"),
-    path('<int:pk>/reviews/', views.createProductReview, name="create-review"),
+    path('<int:pk>/reviews/', views.productReviews, name="product-reviews"),
     path('<int:pk>/', views.getProduct, name='product'),
     path('update/<int:pk>/', views.updateProduct, name='product-update'),
     path('delete/<int:pk>/', views.deleteProduct, name='product-delete'),
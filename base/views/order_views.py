@@ -1,163 +1,287 @@
+import json
 import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
 from django.shortcuts import get_object_or_404
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
-from datetime import datetime, timedelta
-from base.models import Product, Order, OrderItem, ShippingAddress
-from base.serializers import OrderSerializer
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from base.models import Product, ProductVariant, Order, OrderItem, ShippingAddress
+from base.serializers import OrderSerializer, OrderSummarySerializer
+from base.pagination import paginate_cursor, InvalidCursor
+from base.conditional import conditional, list_validators
+from base.reservations import hold_stock, confirm_order, sweep_expired, with_available, OutOfStock
+from base import orderstate
+from base.orderstate import InvalidTransition, RefundExceedsTotal
+from base.media_urls import media_url
+from base.idempotency import idempotent
+from base.throttling import CheckoutThrottle
+from base.changefeed import MAX_CHANGES, changes_since, parse_since
+from base.authentication import CachedJWTAuthentication, EventStreamToken
+from base.events import ADMIN_CHANNEL, get_backend, hub, publish_order_event, user_channel
+from base.exports import FORMATS, async_chunks, export_rows, filter_orders
+from base.dashboard import dashboard_summary
+from base.rollups import BUCKETS, order_series, record_order, record_paid, record_delivered, record_refund
 
 # Set up a logger
 logger = logging.getLogger(__name__)
 
+
+def _variantId(line):
+    # Cart lines without variants reuse the product id as variantId; callers
+    # also check the variant belongs to the line's product
+    value = str(line.get('variantId') or '')
+    return int(value) if value.isdigit() else None
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([CheckoutThrottle])
+@idempotent
 def addOrderItems(request):
     user = request.user
     data = request.data
 
-    print("Incoming order data:", data)  # Debugging: print incoming data
-
     try:
         # Validate that order items are present
         orderItems = data.get('orderItems', [])
         if not orderItems:
             return Response({'detail': 'No Order Items'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create the order
-        order = Order.objects.create(
-            user=user,
-            paymentMethod=data['paymentMethod'],
-            taxPrice=data['taxPrice'],
-            shippingPrice=data['shippingPrice'],
-            totalPrice=data['totalPrice'],
-            createdAt=datetime.now()  # Ensure createdAt is populated
-        )
-        print("Order created with ID:", order._id)
-
-        # Create the shipping address
-        shipping = ShippingAddress.objects.create(
-            order=order,
-            address=data['shippingAddress']['address'],
-            city=data['shippingAddress']['city'],
-            postalCode=data['shippingAddress']['postalCode'],
-            country=data['shippingAddress']['country'],
-        )
-        print("Shipping address created for order ID:", order._id)
-
-        # Create order items and update stock
         for i in orderItems:
-            product = Product.objects.get(_id=i['product'])
-            print("Processing product:", product.name)
+            if int(i['qty']) <= 0:
+                return Response({'detail': 'Invalid quantity'}, status=status.HTTP_400_BAD_REQUEST)
+        product_ids = {int(i['product']) for i in orderItems}
+        variant_ids = {_variantId(i) for i in orderItems} - {None}
+
+        # Hand back lapsed holds first so their units can be held again
+        sweep_expired()
+
+        # Everything below commits or rolls back as one unit
+        with transaction.atomic():
+            products = Product.objects.only('_id', 'name', 'image').in_bulk(list(product_ids), field_name='_id')
+            if len(products) != len(product_ids):
+                raise Product.DoesNotExist
+            variants = ProductVariant.objects.in_bulk(list(variant_ids)) if variant_ids else {}
+
+            order = Order.objects.create(
+                user=user,
+                paymentMethod=data['paymentMethod'],
+                taxPrice=data['taxPrice'],
+                shippingPrice=data['shippingPrice'],
+                totalPrice=data['totalPrice'],
+            )
 
-            OrderItem.objects.create(
-                product=product,
+            record_order(order)
+
+            ShippingAddress.objects.create(
                 order=order,
-                name=product.name,
-                qty=i['qty'],
-                price=i['price'],
-                image=product.image.url,
+                address=data['shippingAddress']['address'],
+                city=data['shippingAddress']['city'],
+                postalCode=data['shippingAddress']['postalCode'],
+                country=data['shippingAddress']['country'],
             )
-            print(f"Order item created for product {product.name}")
 
-            # Update stock
-            product.countInStock -= i['qty']
-            product.save()
-            print(f"Stock updated for {product.name}, new stock: {product.countInStock}")
+            items = []
+            lines = []
+            for i in orderItems:
+                product = products[int(i['product'])]
+                variant = variants.get(_variantId(i))
+                if variant is not None and variant.product_id != product._id:
+                    variant = None
+                lines.append((product, variant, int(i['qty'])))
+                items.append(OrderItem(
+                    product=product,
+                    order=order,
+                    name=product.name,
+                    qty=i['qty'],
+                    price=i['price'],
+                    image=media_url(product.image.name),
+                ))
+            OrderItem.objects.bulk_create(items)
+
+            # Hold the stock until the order is paid (or the hold expires);
+            # holds are conditional updates, so concurrent checkouts cannot oversell
+            hold_stock(lines, user=user, order=order)
 
+        order = OrderSerializer.setup_eager_loading(Order.objects.all()).get(_id=order._id)
         serializer = OrderSerializer(order, many=False)
         return Response(serializer.data)
 
-    except Product.DoesNotExist as e:
-        print("Product not found:", str(e))
+    except OutOfStock as e:
+        return Response({'detail': f'Not enough stock for {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    except Product.DoesNotExist:
         return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
+    except (KeyError, TypeError, ValueError) as e:
+        return Response({'detail': f'Invalid order data: {e}'}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        print("Unexpected error:", str(e))
+        logger.error(f"Failed to create order: {str(e)}")
         return Response({'detail': 'An unexpected error occurred', 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     
+def _orderChanges(request, orders, serializer_class=OrderSerializer):
+    """?since=<cursor> sync: only orders created or modified after the
+    cursor (0 for a first sync), oldest first, plus the cursor to send next."""
+    params = request.query_params
+    since = parse_since(params.get('since'))
+    limit = int(params.get('limit', 100))
+    rows, cursor, has_more = changes_since(serializer_class.setup_eager_loading(orders, request), since, limit)
+    return Response({
+        'results': serializer_class(rows, many=True, context={'request': request}).data,
+        'cursor': cursor,
+        'hasMore': has_more,
+    })
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def getMyOrders(request):
     user = request.user
     try:
-        orders = user.order_set.all()
-        serializer = OrderSerializer(orders, many=True)
+        if 'since' in request.query_params:
+            return _orderChanges(request, user.order_set.all())
+        orders = OrderSerializer.setup_eager_loading(user.order_set.all(), request)
+        serializer = OrderSerializer(orders, many=True, context={'request': request})
         return Response(serializer.data)
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(f"Failed to retrieve user orders: {str(e)}")
         return Response({'detail': 'Failed to retrieve user orders'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+ORDER_SORTS = ['createdAt', 'updatedAt', 'totalPrice', 'paidAt', 'deliveredAt', '_id']
+
+
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def getOrders(request):
+    """All orders for admins. Without ?cursor= this keeps returning a plain
+    list; ?cursor= (empty for the first page) pages with next/prev cursors.
+    ?since= returns only changes, see _orderChanges.
+    ?summary=1 drops items, address and the nested user from each row."""
     try:
-        orders = Order.objects.all()
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        params = request.query_params
+        try:
+            orders = filter_orders(Order.objects.all(), params)
+            page_size = min(max(int(params.get('page_size', 50)), 1), 200)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        sort_by = params.get('sort_by', 'createdAt')
+        if sort_by not in ORDER_SORTS:
+            return Response({'detail': f'Cannot sort orders by {sort_by}'}, status=status.HTTP_400_BAD_REQUEST)
+        descending = params.get('order', 'desc') == 'desc'
+        serializer_class = OrderSummarySerializer if params.get('summary') in ('1', 'true') else OrderSerializer
+        if 'since' in params:
+            try:
+                return _orderChanges(request, orders, serializer_class)
+            except ValueError as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        last_modified, total = list_validators(orders)
+        eager = serializer_class.setup_eager_loading(orders, request)
+
+        def build():
+            context = {'request': request}
+            if 'cursor' in params:
+                rows, meta = paginate_cursor(request, eager, sort_by, descending, page_size)
+                return Response({'results': serializer_class(rows, many=True, context=context).data, **meta})
+            rows = eager.order_by(f"{'-' if descending else ''}{sort_by}", '-_id' if descending else '_id') if 'sort_by' in params else eager
+            return Response(serializer_class(rows, many=True, context=context).data)
+
+        return conditional(request, build, last_modified, total, private=True)
+    except InvalidCursor as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(f"Failed to retrieve all orders: {str(e)}")
         return Response({'detail': 'Failed to retrieve all orders'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def exportOrders(request, fmt):
+    """Stream orders joined with their items and shipping address as CSV or
+    NDJSON, one line per item. Takes the same filters as the order list."""
+    if fmt not in FORMATS:
+        return Response({'detail': f'Unknown export format: {fmt}'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        orders = filter_orders(Order.objects.all(), request.query_params)
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    lines, content_type = FORMATS[fmt]
+    content = lines(export_rows(orders))
+    if isinstance(request._request, ASGIRequest):
+        # Under ASGI a sync iterator would be collected in full before sending
+        content = async_chunks(content)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+    response['Content-Disposition'] = f'attachment; filename="orders-{stamp}.{fmt}"'
+    return response
+
+
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def ordersAnalytics(request):
-    """Return simple aggregates for the dashboard charts.
-    Query: ?days=30 (default 30)
+    """Return bucketed order series and totals for the dashboard charts.
+    Query: ?days=30 (default 30), ?bucket=day|week|month (default day)
     """
     try:
         try:
             days = int(request.query_params.get('days', 30))
         except Exception:
             days = 30
-        cutoff = datetime.now() - timedelta(days=days if days > 0 else 3650)
-        qs = Order.objects.filter(createdAt__gte=cutoff).order_by('createdAt')
-        items = []
-        total_sales = 0
-        paid = 0
-        delivered = 0
-        low_stock = 0
-        for o in qs:
-            items.append({
-                'id': o._id,
-                'createdAt': o.createdAt,
-                'totalPrice': float(o.totalPrice or 0),
-                'isPaid': bool(o.isPaid),
-                'isDelivered': bool(o.isDelivered),
-            })
-            total_sales += float(o.totalPrice or 0)
-            if o.isPaid: paid += 1
-            if o.isDelivered: delivered += 1
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in BUCKETS:
+            return Response({'detail': f'Invalid bucket: {bucket}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        series = order_series(days if days > 0 else 3650, bucket)
+        totals = {f: sum(row[f] for row in series) for f in ('orderCount', 'sales', 'paidCount', 'deliveredCount', 'refunds', 'netRevenue')}
 
         # low stock quick stat
-        low_stock = Product.objects.filter(countInStock__gt=0, countInStock__lt=5).count()
+        totals['lowStockCount'] = with_available(Product.objects.all()).filter(available__gt=0, available__lt=5).count()
 
         return Response({
-            'orders': items,
-            'totals': {
-                'sales': total_sales,
-                'paidCount': paid,
-                'deliveredCount': delivered,
-                'lowStockCount': low_stock,
-            }
+            'bucket': bucket,
+            'series': series,
+            'totals': totals,
         })
     except Exception as e:
         logger.error(f"ordersAnalytics failed: {str(e)}")
         return Response({'detail': 'Failed to compute analytics'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def dashboardSummary(request):
+    """KPI totals, order status counts, low stock and recent orders for the
+    admin dashboard in one request. Cached for a few seconds."""
+    try:
+        return Response(dashboard_summary())
+    except Exception as e:
+        logger.error(f"dashboardSummary failed: {str(e)}")
+        return Response({'detail': 'Failed to compute dashboard summary'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def getOrderById(request, pk):
     user = request.user
     try:
-        order = Order.objects.get(_id=pk)
-        if user.is_staff or order.user == user:
-            serializer = OrderSerializer(order, many=False)
-            return Response(serializer.data)
+        # Authorize and check validators from two columns before loading the full order
+        owner_id, last_modified = Order.objects.values_list('user_id', 'updatedAt').get(_id=pk)
+        if user.is_staff or owner_id == user.id:
+            def build():
+                order = OrderSerializer.setup_eager_loading(Order.objects.all(), request).get(_id=pk)
+                return Response(OrderSerializer(order, many=False, context={'request': request}).data)
+            return conditional(request, build, last_modified, private=True)
         else:
             return Response({'detail': 'Not authorized to view this order'}, status=status.HTTP_403_FORBIDDEN)
     except Order.DoesNotExist:
@@ -170,15 +294,24 @@ def getOrderById(request, pk):
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def updateOrderToPaid(request, pk):
     try:
-        order = Order.objects.get(_id=pk)
-
-        order.isPaid = True
-        order.paidAt = datetime.now()
-        order.save()
+        with transaction.atomic():
+            # The conditional status update locks the order, so a concurrent
+            # second payment fails the transition instead of selling twice
+            order = orderstate.pay(pk)
+            # Turn the checkout holds into sold stock. The payment is already
+            # captured, so lapsed holds that cannot be re-taken are backordered
+            backordered = confirm_order(order)
+            record_paid(order)
+            publish_order_event(order, 'paid')
 
+        if backordered:
+            return Response({'detail': 'Order was paid; some items are backordered', 'isBackordered': True})
         return Response({'detail': 'Order was paid'})
+    except InvalidTransition as e:
+        return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
     except Order.DoesNotExist:
         logger.error("Order not found")
         return Response({'detail': 'Order does not exist'}, status=status.HTTP_404_NOT_FOUND)
@@ -191,13 +324,14 @@ def updateOrderToPaid(request, pk):
 @permission_classes([IsAdminUser])
 def updateOrderToDelivered(request, pk):
     try:
-        order = Order.objects.get(_id=pk)
-
-        order.isDelivered = True
-        order.deliveredAt = datetime.now()
-        order.save()
+        with transaction.atomic():
+            order = orderstate.deliver(pk)
+            record_delivered(order)
+            publish_order_event(order, 'delivered')
 
         return Response({'detail': 'Order was delivered'})
+    except InvalidTransition as e:
+        return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
     except Order.DoesNotExist:
         logger.error("Order not found")
         return Response({'detail': 'Order does not exist'}, status=status.HTTP_404_NOT_FOUND)
@@ -210,18 +344,122 @@ def updateOrderToDelivered(request, pk):
 @permission_classes([IsAdminUser])
 def refundOrder(request, pk):
     try:
-        order = Order.objects.get(_id=pk)
         amount = float(request.data.get('amount', 0))
         if amount <= 0:
             return Response({'detail': 'Invalid refund amount'}, status=status.HTTP_400_BAD_REQUEST)
-        prev = float(order.refundTotal or 0)
-        order.refundTotal = prev + amount
-        order.refundedAt = datetime.now()
-        order.save()
+        with transaction.atomic():
+            order = orderstate.refund(pk, amount)
+            record_refund(order, amount)
+            publish_order_event(order, 'refunded')
         return Response({'detail': 'Order refunded', 'refundTotal': order.refundTotal})
+    except RefundExceedsTotal as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except InvalidTransition as e:
+        return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
     except Order.DoesNotExist:
         logger.error("Order not found")
         return Response({'detail': 'Order does not exist'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
         return Response({'detail': 'An error occurred', 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def orderQueue(request, name):
+    """Admin work queue (awaiting-payment, awaiting-fulfillment, refunded)
+    as cursor pages of summary rows, read from the queue's partial index."""
+    if name not in orderstate.QUEUES:
+        return Response({'detail': f'Unknown queue: {name}'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        page_size = min(max(int(request.query_params.get('page_size', 50)), 1), 200)
+        orders, newest_first = orderstate.queue(name)
+        rows, meta = paginate_cursor(request, OrderSummarySerializer.setup_eager_loading(orders), 'createdAt', newest_first, page_size)
+        return Response({'results': OrderSummarySerializer(rows, many=True).data, **meta})
+    except (InvalidCursor, ValueError) as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Failed to load order queue: {str(e)}")
+        return Response({'detail': 'Failed to load order queue'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def orderEventsToken(request):
+    """A short-lived token for opening the event stream with ?token=."""
+    token = EventStreamToken.for_user(request.user)
+    return Response({'token': str(token), 'expiresIn': int(EventStreamToken.lifetime.total_seconds())})
+
+
+async def _streamUser(request):
+    # A Bearer access token in the header, or (as EventSource cannot send
+    # headers) a stream token from orderEventsToken as ?token=
+    header = request.headers.get('Authorization', '')
+    auth = CachedJWTAuthentication()
+    try:
+        if header.startswith('Bearer '):
+            token = auth.get_validated_token(header[7:])
+        elif request.GET.get('token'):
+            token = EventStreamToken(request.GET['token'])
+        else:
+            return None
+        return await sync_to_async(auth.get_user)(token)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+
+
+def _sse(message):
+    return f"id: {message['changeSeq']}\nevent: order\ndata: {json.dumps(message)}\n\n"
+
+
+def _missedEvents(user, order_id, last_id):
+    """Current state of every order changed since the client's last event id."""
+    orders = Order.objects.filter(changeSeq__gt=last_id)
+    if not user.is_staff:
+        orders = orders.filter(user=user)
+    if order_id:
+        orders = orders.filter(_id=order_id)
+    rows = orders.order_by('changeSeq').values(
+        '_id', 'status', 'isPaid', 'paidAt', 'isDelivered', 'deliveredAt', 'refundTotal', 'changeSeq')[:MAX_CHANGES]
+    return [json.loads(json.dumps({'event': 'sync', 'orderId': row.pop('_id'), **row}, cls=DjangoJSONEncoder)) for row in rows]
+
+
+async def _eventStream(user, channels, order_id, last_id):
+    get_backend().start()
+    subscription = hub.subscribe(channels)
+    heartbeat = getattr(settings, 'ORDER_EVENTS_HEARTBEAT_SECONDS', 15)
+    try:
+        yield 'retry: 3000\n\n'
+        if last_id is not None:
+            for message in await sync_to_async(_missedEvents)(user, order_id, last_id):
+                yield _sse(message)
+        while True:
+            message = await subscription.get(heartbeat)
+            if message is None:
+                yield ': keepalive\n\n'
+            elif not order_id or message['orderId'] == order_id:
+                yield _sse(message)
+    finally:
+        subscription.close()
+
+
+async def orderEvents(request):
+    """Server-Sent Events stream of order status changes (paid, delivered,
+    refunded): the user's own orders, or all orders for admins. ?order=<id>
+    narrows it to one order; Last-Event-ID resumes after a reconnect. Idle
+    connections cost a queue and a heartbeat, nothing is re-serialized.
+    Authenticates with a Bearer header or ?token= from orderEventsToken.
+    Needs an ASGI server."""
+    user = await _streamUser(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    try:
+        order_id = int(request.GET['order']) if request.GET.get('order') else None
+        last_id = parse_since(request.headers['Last-Event-ID']) if request.headers.get('Last-Event-ID') else None
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid order or Last-Event-ID'}, status=400)
+    channels = [ADMIN_CHANNEL] if user.is_staff else [user_channel(user.id)]
+    response = StreamingHttpResponse(_eventStream(user, channels, order_id, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
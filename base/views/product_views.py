@@ -1,35 +1,72 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework import status
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger  # Import for pagination
+from django.db import IntegrityError, transaction
 from django.db.models import Q  
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly
 from base.models import Product, Review, ProductVariant, ProductMedia, Collection, CollectionEntry, ProductMediaLink
-from base.serializers import ProductSerializer, ProductVariantSerializer, ProductMediaSerializer, CollectionSerializer, CollectionEntrySerializer, ProductMediaLinkSerializer
+from base.serializers import ProductSerializer, ReviewSerializer, ProductVariantSerializer, ProductMediaSerializer, CollectionSerializer, CollectionEntrySerializer, ProductMediaLinkSerializer
+from base.search import search_products
+from base.throttling import SearchThrottle
+from base.ratings import record_review, STARS
+from base.reservations import available_to_sell, sweep_expired
+from base.pagination import paginate_cursor, keyset_page, InvalidCursor
+from base.conditional import conditional, list_validators
+from base.cache import catalog_key, cached_catalog_response, cache_stats, bump_catalog_version
 from django.core.paginator import Paginator
 import logging
 
 logger = logging.getLogger(__name__)
 
 @api_view(['GET'])
+@throttle_classes([SearchThrottle])
 def getProducts(request):
     query = request.query_params.get('keyword', '')
-    sort_by = request.query_params.get('sort_by', 'name')  # Default sort by name
+    # Default sort by relevance when searching, by name otherwise
+    sort_by = request.query_params.get('sort_by', 'relevance' if query else 'name')
     order = request.query_params.get('order', 'asc')  # Default order ascending
+    page = request.query_params.get('page', 1)
+    cursor = request.query_params.get('cursor')
+    count = request.query_params.get('count')
+    fields = request.query_params.get('fields')
+    expand = request.query_params.get('expand')
+
+    key = catalog_key('products', request.build_absolute_uri('/'), query, sort_by, order, page, cursor, count, fields, expand)
+    validators_key = catalog_key('products-validators', query)
+    last_modified, total = cached_catalog_response(validators_key, lambda: list_validators(search_products(Product.objects.all(), query)))
+    try:
+        return conditional(request, lambda: Response(cached_catalog_response(key, lambda: _productsPage(request, query, sort_by, order, page))), last_modified, total)
+    except InvalidCursor as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 
-    products = Product.objects.filter(name__icontains=query)
+def _productsPage(request, query, sort_by, order, page):
+    products = ProductSerializer.setup_eager_loading(search_products(Product.objects.all(), query), request)
+
+    # Cursor mode (?cursor=, empty for the first page): seek on sort key + pk
+    if 'cursor' in request.query_params:
+        if sort_by in ['price', 'rating', 'name']:
+            rows, meta = paginate_cursor(request, products, sort_by, order == 'desc', 8)
+        elif sort_by == 'relevance' and query:
+            rows, meta = paginate_cursor(request, products, 'search_rank', True, 8)
+        else:
+            rows, meta = paginate_cursor(request, products, 'name', False, 8)
+        serializer = ProductSerializer(rows, many=True, context={'request': request})
+        return {'products': serializer.data, **meta}
 
     # Sorting logic
     if sort_by in ['price', 'rating', 'name']:
         if order == 'desc':
             sort_by = f'-{sort_by}'
         products = products.order_by(sort_by)
+    elif sort_by == 'relevance' and query:
+        products = products.order_by('-search_rank', '_id')
     else:
         # Default sorting
         products = products.order_by('name')
 
     # Pagination
-    page = request.query_params.get('page', 1)
     paginator = Paginator(products, 8)
 
     try:
@@ -39,20 +76,46 @@ def getProducts(request):
 
     page = int(page)
     serializer = ProductSerializer(products, many=True, context={'request': request})
-    return Response({'products': serializer.data, 'page': page, 'pages': paginator.num_pages})
+    return {'products': serializer.data, 'page': page, 'pages': paginator.num_pages}
 
 @api_view(['GET'])
 def getProduct(request, pk):
     try:
-        product = Product.objects.get(_id=pk)
-        serializer = ProductSerializer(product, many=False, context={'request': request})
-        return Response(serializer.data)
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        key = catalog_key('product', request.build_absolute_uri('/'), pk, fields, expand)
+        validators_key = catalog_key('product-validators', pk)
+        last_modified = cached_catalog_response(validators_key, lambda: list_validators(Product.objects.filter(_id=pk)))[0]
+        if last_modified is None:
+            raise Product.DoesNotExist
+        return conditional(request, lambda: Response(cached_catalog_response(key, lambda: _productDetail(request, pk))), last_modified)
     except Product.DoesNotExist:
         return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         logger.error(f"Error fetching product with ID {pk}: {e}")
         return Response({'detail': 'Error fetching product'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+def _productDetail(request, pk):
+    product = ProductSerializer.setup_eager_loading(Product.objects.all(), request).get(_id=pk)
+    serializer = ProductSerializer(product, many=False, context={'request': request})
+    return serializer.data
+
+
+@api_view(['GET'])
+def getAvailability(request):
+    """Available-to-sell units for ?ids=1,2,3 (products and their variants).
+    Not cached: this is the live stock figure the catalog pages leave out."""
+    ids = [int(i) for i in request.query_params.get('ids', '').split(',') if i.strip().isdigit()][:100]
+    sweep_expired()
+    return Response(available_to_sell(ids))
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def catalogCacheStats(request):
+    return Response(cache_stats())
+
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
 def createProduct(request):
@@ -118,6 +181,28 @@ def uploadImage(request):
         return Response({'detail': 'No image file provided'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _adminListPage(request, qs, serializer_class, default_sort, default_order, context=False):
+    sort_by = request.query_params.get('sort_by', default_sort)
+    order = request.query_params.get('order', default_order)
+    page_size = int(request.query_params.get('page_size', 50))
+    kwargs = {'context': {'request': request}} if context else {}
+    if 'cursor' in request.query_params:
+        try:
+            rows, meta = paginate_cursor(request, qs, sort_by, order == 'desc', page_size)
+        except InvalidCursor as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = serializer_class(rows, many=True, **kwargs)
+        return Response({ 'results': serializer.data, **meta })
+    if order == 'desc':
+        sort_by = f'-{sort_by}'
+    qs = qs.order_by(sort_by)
+    page = int(request.query_params.get('page', 1))
+    paginator = Paginator(qs, page_size)
+    page_obj = paginator.get_page(page)
+    serializer = serializer_class(page_obj.object_list, many=True, **kwargs)
+    return Response({ 'results': serializer.data, 'page': page_obj.number, 'pages': paginator.num_pages, 'count': paginator.count })
+
+
 # Admin: variants
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
@@ -126,17 +211,8 @@ def listVariants(request):
     product_id = request.query_params.get('product_id')
     if product_id:
         qs = qs.filter(product_id=product_id)
-    sort_by = request.query_params.get('sort_by', 'product_id')
-    order = request.query_params.get('order', 'asc')
-    if order == 'desc':
-        sort_by = f'-{sort_by}'
-    qs = qs.order_by(sort_by)
-    page_size = int(request.query_params.get('page_size', 50))
-    page = int(request.query_params.get('page', 1))
-    paginator = Paginator(qs, page_size)
-    page_obj = paginator.get_page(page)
-    serializer = ProductVariantSerializer(page_obj.object_list, many=True)
-    return Response({ 'results': serializer.data, 'page': page_obj.number, 'pages': paginator.num_pages, 'count': paginator.count })
+    last_modified, total = list_validators(qs)
+    return conditional(request, lambda: _adminListPage(request, qs, ProductVariantSerializer, 'product_id', 'asc'), last_modified, total)
 
 
 @api_view(['POST'])
@@ -176,17 +252,8 @@ def listMedia(request):
     role = request.query_params.get('role')
     if role:
         qs = qs.filter(role=role)
-    sort_by = request.query_params.get('sort_by', 'position')
-    order = request.query_params.get('order', 'asc')
-    if order == 'desc':
-        sort_by = f'-{sort_by}'
-    qs = qs.order_by(sort_by)
-    page_size = int(request.query_params.get('page_size', 50))
-    page = int(request.query_params.get('page', 1))
-    paginator = Paginator(qs, page_size)
-    page_obj = paginator.get_page(page)
-    serializer = ProductMediaSerializer(page_obj.object_list, many=True, context={'request': request})
-    return Response({ 'results': serializer.data, 'page': page_obj.number, 'pages': paginator.num_pages, 'count': paginator.count })
+    last_modified, total = list_validators(qs)
+    return conditional(request, lambda: _adminListPage(request, qs, ProductMediaSerializer, 'position', 'asc', context=True), last_modified, total)
 
 
 @api_view(['POST'])
@@ -222,25 +289,16 @@ def deleteMedia(request, pk):
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def listCollections(request):
-    qs = Collection.objects.all()
-    sort_by = request.query_params.get('sort_by', 'createdAt')
-    order = request.query_params.get('order', 'desc')
-    if order == 'desc':
-        sort_by = f'-{sort_by}'
-    qs = qs.order_by(sort_by)
-    page_size = int(request.query_params.get('page_size', 50))
-    page = int(request.query_params.get('page', 1))
-    paginator = Paginator(qs, page_size)
-    page_obj = paginator.get_page(page)
-    serializer = CollectionSerializer(page_obj.object_list, many=True, context={'request': request})
-    return Response({ 'results': serializer.data, 'page': page_obj.number, 'pages': paginator.num_pages, 'count': paginator.count })
+    qs = CollectionSerializer.setup_eager_loading(Collection.objects.all(), request)
+    last_modified, total = list_validators(qs)
+    return conditional(request, lambda: _adminListPage(request, qs, CollectionSerializer, 'createdAt', 'desc', context=True), last_modified, total)
 
 
 # Admin: product-media links
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def listProductMediaLinks(request, product_pk):
-    qs = ProductMediaLink.objects.filter(product_id=product_pk).order_by('position', 'id')
+    qs = ProductMediaLink.objects.filter(product_id=product_pk).select_related('media').order_by('position', 'id')
     serializer = ProductMediaLinkSerializer(qs, many=True, context={'request': request})
     return Response(serializer.data)
 
@@ -289,7 +347,9 @@ def reorderProductMedia(request, product_pk):
                 ProductMediaLink.objects.filter(id=link_id, product_id=product_pk).update(position=pos)
             except Exception:
                 continue
-        qs = ProductMediaLink.objects.filter(product_id=product_pk).order_by('position', 'id')
+        # queryset.update() skips post_save, so invalidate cached catalog pages here
+        bump_catalog_version()
+        qs = ProductMediaLink.objects.filter(product_id=product_pk).select_related('media').order_by('position', 'id')
         serializer = ProductMediaLinkSerializer(qs, many=True, context={'request': request})
         return Response(serializer.data)
     except Exception as e:
@@ -329,7 +389,7 @@ def deleteCollection(request, pk):
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def listCollectionEntries(request, collection_pk):
-    qs = CollectionEntry.objects.filter(collection_id=collection_pk).order_by('position')
+    qs = CollectionEntry.objects.filter(collection_id=collection_pk).select_related('media').order_by('position')
     serializer = CollectionEntrySerializer(qs, many=True, context={'request': request})
     return Response(serializer.data)
 
@@ -364,39 +424,67 @@ def deleteCollectionEntry(request, pk):
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticatedOrReadOnly])
+def productReviews(request, pk):
+    if request.method == 'POST':
+        return createProductReview(request, pk)
+    return getProductReviews(request, pk)
+
+
+def getProductReviews(request, pk):
+    """Newest-first reviews for a product, cursor paginated (?cursor=, ?page_size=)."""
+    try:
+        page_size = min(max(int(request.query_params.get('page_size', 10)), 1), 50)
+    except ValueError:
+        page_size = 10
+    cursor = request.query_params.get('cursor', '')
+
+    def build():
+        if not Product.objects.filter(_id=pk).exists():
+            raise Product.DoesNotExist
+        qs = Review.objects.filter(product_id=pk)
+        rows, next_cursor, prev_cursor = keyset_page(qs, '_id', True, page_size, cursor)
+        return {'reviews': ReviewSerializer(rows, many=True).data, 'next': next_cursor, 'prev': prev_cursor}
+
+    try:
+        key = catalog_key('reviews', pk, page_size, cursor)
+        return Response(cached_catalog_response(key, build))
+    except InvalidCursor as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Product.DoesNotExist:
+        return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
+
+
 def createProductReview(request, pk):
     try:
         user = request.user
-        product = Product.objects.get(_id=pk)
+        product = Product.objects.only('_id').get(_id=pk)
         data = request.data
 
-        # 1 - Check if Review Already Exists
-        alreadyExists = product.review_set.filter(user=user).exists()
-        if alreadyExists:
-            return Response({'detail': 'Product already reviewed'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # 2 - Validate Rating
-        if 'rating' not in data or data['rating'] == 0:
+        # 1 - Validate Rating
+        try:
+            rating = int(data.get('rating', 0))
+        except (TypeError, ValueError):
+            rating = 0
+        if rating not in STARS:
             return Response({'detail': 'Please select a rating'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 3 - Create Review
-        review = Review.objects.create(
-            user=user,
-            product=product,
-            name=user.first_name,
-            rating=data['rating'],
-            comment=data.get('comment', ''),
-        )
-
-        # Update Product Reviews Count and Rating
-        reviews = product.review_set.all()
-        product.numReviews = reviews.count()
-        product.rating = sum([rev.rating for rev in reviews]) / reviews.count()
-        product.save()
+        # 2 - Create Review and fold it into the product aggregates atomically;
+        # the (product, user) unique constraint rejects duplicates
+        with transaction.atomic():
+            Review.objects.create(
+                user=user,
+                product=product,
+                name=user.first_name,
+                rating=rating,
+                comment=data.get('comment', ''),
+            )
+            record_review(product._id, rating)
 
         return Response({'detail': 'Review added successfully'}, status=status.HTTP_201_CREATED)
+    except IntegrityError:
+        return Response({'detail': 'Product already reviewed'}, status=status.HTTP_400_BAD_REQUEST)
     except Product.DoesNotExist:
         return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
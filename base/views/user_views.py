@@ -1,10 +1,14 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny,IsAdminUser
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
 from rest_framework import status
-from base.serializers import UserSerializer, UserSerializerWithToken
+from rest_framework.exceptions import AuthenticationFailed
+from django.db.models import Q
+from base.serializers import UserSerializer, UserSerializerWithToken, UserDirectorySerializer
+from base.pagination import paginate_cursor, InvalidCursor
+from base.throttling import LoginThrottle, RegisterThrottle
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
@@ -20,12 +24,21 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
+    throttle_classes = [LoginThrottle]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            return super().post(request, *args, **kwargs)
+        except AuthenticationFailed:
+            LoginThrottle().record_failure(request)
+            raise
     
 import logging
 logger = logging.getLogger(__name__)
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RegisterThrottle])
 def registerUser(request):
     logger.debug("registerUser called")
     data = request.data
@@ -34,7 +47,7 @@ def registerUser(request):
         if 'name' not in data or 'email' not in data or 'password' not in data:
             return Response({'detail': 'Name, email, and password are required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if User.objects.filter(email=data['email']).exists():
+        if User.objects.filter(email__iexact=data['email']).exists():
             return Response({'detail': 'A user with this email already exists'}, status=status.HTTP_400_BAD_REQUEST)
 
         user = User.objects.create(
@@ -83,12 +96,39 @@ def getUserProfile(request):
     serializer = UserSerializer(user, many=False)
     return Response(serializer.data)
 
+USER_SORTS = ['email', 'first_name', 'date_joined', 'orderCount', 'lifetimeSpend']
+
+
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def getUsers(request):
-    users = User.objects.all()
-    serializer = UserSerializer(users, many=True)
-    return Response(serializer.data)
+    """Admin user directory with per-user order counts and lifetime spend.
+    ?search= matches a prefix of email or name. Without ?cursor= this keeps
+    returning a plain list; ?cursor= (empty for the first page) pages it."""
+    params = request.query_params
+    try:
+        page_size = min(max(int(params.get('page_size', 50)), 1), 200)
+        sort_by = params.get('sort_by', 'email')
+        if sort_by not in USER_SORTS:
+            return Response({'detail': f'Cannot sort users by {sort_by}'}, status=status.HTTP_400_BAD_REQUEST)
+        descending = params.get('order', 'asc') == 'desc'
+
+        users = User.objects.all()
+        search = params.get('search', '').strip()
+        if search:
+            # Backed by the case-insensitive email and name indexes
+            users = users.filter(Q(email__istartswith=search) | Q(first_name__istartswith=search))
+        users = UserDirectorySerializer.setup_eager_loading(users)
+
+        if 'cursor' in params:
+            rows, meta = paginate_cursor(request, users, sort_by, descending, page_size)
+            return Response({'results': UserDirectorySerializer(rows, many=True).data, **meta})
+        return Response(UserDirectorySerializer(users.order_by(f"{'-' if descending else ''}{sort_by}", 'id'), many=True).data)
+    except (InvalidCursor, ValueError) as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Failed to retrieve users: {str(e)}")
+        return Response({'detail': 'Failed to retrieve users'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])